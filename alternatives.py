@@ -0,0 +1,290 @@
+import weakref
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, load_transfers, time_to_seconds
+from lower_bounds import dijkstra, reverse_graph, timetable_min_time_graph
+from raptor import INF, RaptorSearch, Transfers, make_journey, make_leg
+
+
+class Label(NamedTuple):
+    """多标签搜索中的一个部分行程"""
+    time: int
+    # 已乘坐的 trip 集合：按本次搜索中首次上车的顺序给 trip 分配位，trips 为对应的位掩码
+    trips: int
+    # 换乘站序列（下车站点索引）
+    stops: Tuple[int, ...]
+    # 乘车: ('ride', 上车标签, pattern, row, board_pos, alight_pos)；换乘: ('transfer', 到达标签, 换乘时间)
+    parent: Optional[tuple]
+
+
+def overlap(a: Label, b: Label) -> float:
+    """两个部分行程的 trip 重合度（Jaccard 系数）"""
+    union = a.trips | b.trips
+    if not union:
+        return 1.0
+    return (a.trips & b.trips).bit_count() / union.bit_count()
+
+
+def _insert(bag: List[Label], label: Label, capacity: int, penalty: float, removed: Dict[int, Label]) -> bool:
+    """
+    将标签加入站点的标签集合，返回是否保留；被淘汰的标签按 id 记入 removed。
+
+    到达更早且所乘 trip 是其子集的标签支配新标签；trip 集合相同而换乘站不同的标签互不支配，
+    作为不同的备选同时保留。超出容量时淘汰“到达时间 + penalty * 与最早到达标签的重合度”最大的标签，
+    使保留的标签尽量互不相同。
+    """
+    time, trips, stops = label.time, label.trips, label.stops
+    dominated = None
+    for i, other in enumerate(bag):
+        common = other.trips & trips
+        if other.trips == trips and other.stops != stops:
+            continue
+        if other.time <= time and common == other.trips:
+            return False
+        if time <= other.time and common == trips:
+            if dominated is None:
+                dominated = []
+            dominated.append(i)
+    if dominated is not None:
+        for i in reversed(dominated):
+            other = bag.pop(i)
+            removed[id(other)] = other
+    bag.append(label)
+    if len(bag) <= capacity:
+        return True
+    # 只有超出容量时才需要计算重合度
+    best = min(bag, key=lambda x: x.time)
+    best_trips = best.trips
+    worst, worst_score = -1, -1.0
+    for i, other in enumerate(bag):
+        score = other.time
+        if other is not best:
+            union = other.trips | best_trips
+            score += penalty * ((other.trips & best_trips).bit_count() / union.bit_count() if union else 1.0)
+        if score > worst_score:
+            worst, worst_score = i, score
+    victim = bag.pop(worst)
+    removed[id(victim)] = victim
+    return victim is not label
+
+
+# 逐步放宽的到达期限（max_delay 的比例）：终点标签集合在较小的期限内装满时，不再放宽
+DEADLINE_STEPS = (0.25, 0.5, 1.0)
+
+# 按时刻表缓存的反向最小行驶时间图，同一时刻表与换乘表的多次查询共用
+_min_time_graphs: 'weakref.WeakKeyDictionary[Timetable, Tuple[Transfers, tuple]]' = weakref.WeakKeyDictionary()
+
+
+def _reverse_min_time_graph(tt: Timetable, transfers: Transfers) -> tuple:
+    cached = _min_time_graphs.get(tt)
+    if cached is None or cached[0] is not transfers:
+        cached = _min_time_graphs[tt] = (transfers, reverse_graph(*timetable_min_time_graph(tt, transfers)))
+    return cached[1]
+
+
+class AlternativesSearch:
+    """
+    多标签 RAPTOR：一次搜索得到多条互不相同的行程。
+
+    每个站点保留最多 labels_per_stop 个到达标签和上车标签，而不是只保留最早到达时间；
+    标签间按 trip 集合做支配判断，超出容量时按重合度惩罚淘汰，因此不同 trip 或不同换乘站的
+    部分行程能同时保留下来。轮次结构与 RaptorSearch 相同，换乘同样只能通过 transfers.json 中的记录。
+
+    剪枝：各站到终点的行程时间下界（最小行驶时间图上的最短路）加上标签时间晚于期限的标签，
+    在构造之前就被丢弃；期限从“最早到达 + max_delay / 4”开始，终点标签集合未装满时才逐步放宽。
+    """
+
+    def __init__(self, tt: Timetable, transfers: Transfers, max_rounds: int = 5,
+                 labels_per_stop: int = 6, penalty: float = 600.0, max_delay: int = 1800):
+        """
+        参数:
+            labels_per_stop (int): 每个站点保留的标签数量上限
+            penalty (float): 与更优标签完全重合时的惩罚（秒）
+            max_delay (int): 比最早到达晚超过该秒数的行程不再作为备选
+        """
+        self.tt = tt
+        self.transfers = transfers
+        self.max_rounds = max_rounds
+        self.labels_per_stop = labels_per_stop
+        self.penalty = penalty
+        self.max_delay = max_delay
+        self.graph = _reverse_min_time_graph(tt, transfers)
+        self.arrivals: Dict[int, List[Label]] = {}
+        self.ready: Dict[int, List[Label]] = {}
+
+    def _bound(self, target: int, deadline: int) -> int:
+        """终点标签已满时，比其中最晚一条还晚的标签也不会再被选中"""
+        bag = self.arrivals.get(target)
+        if bag and len(bag) >= self.labels_per_stop:
+            return min(deadline, max(x.time for x in bag))
+        return deadline
+
+    def run(self, origin: int, dep_sec: int, target: int) -> None:
+        self.arrivals = {}
+        self.ready = {}
+        lower_bounds = dijkstra(*self.graph, target)
+        forward = RaptorSearch(self.tt, self.transfers, self.max_rounds)
+        forward.run(origin, dep_sec, target, lower_bounds)
+        earliest = int(forward.arrival[:, target].min())
+        if earliest >= INF:
+            return
+        remaining = lower_bounds.tolist()
+        for step in DEADLINE_STEPS:
+            self._scan(origin, dep_sec, target, remaining, earliest + int(self.max_delay * step))
+            if len(self.arrivals.get(target, ())) >= self.labels_per_stop:
+                break
+
+    def _scan(self, origin: int, dep_sec: int, target: int, remaining: List[float], deadline: int) -> None:
+        """以 deadline 为终点到达期限进行一次多标签搜索，remaining[s] 为站点 s 到终点的行程时间下界"""
+        tt = self.tt
+        capacity = self.labels_per_stop
+        bound = deadline
+        self.arrivals = {}
+        self.ready = {origin: [Label(dep_sec, 0, (), None)]}
+        new_ready: Dict[int, List[Label]] = {origin: list(self.ready[origin])}
+        # trip -> 位掩码中的位
+        trip_bits: Dict[int, int] = {}
+
+        for _ in range(self.max_rounds):
+            if not new_ready:
+                break
+
+            queue: Dict[int, int] = {}
+            for stop in new_ready:
+                patterns, positions = tt.patterns_at_stop(stop)
+                for pattern, pos in zip(patterns.tolist(), positions.tolist()):
+                    if pos < queue.get(pattern, INF):
+                        queue[pattern] = pos
+
+            improved: Dict[int, List[Label]] = {}
+            # 本轮被淘汰的标签，按 id 索引（同时保存标签本身，保证本轮内 id 不会被复用）
+            removed: Dict[int, Label] = {}
+            for pattern, first_pos in queue.items():
+                stops = tt.pattern_stops_of(pattern).tolist()
+                arr, dep = tt.pattern_times(pattern)
+                trip_base = int(tt.pattern_trip_offsets[pattern])
+                # 已上车的部分行程: (row, 该车次各站到达时间, board_pos, 上车标签, 上车后的 trip 集合)
+                active: List[Tuple[int, List[int], int, Label, int]] = []
+                boarded = set()
+                for i in range(first_pos, len(stops)):
+                    stop = stops[i]
+                    # 在该站的时间晚于 limit 的部分行程不可能在期限内到达终点
+                    limit = bound - remaining[stop]
+                    for row, times, board_pos, ready_label, trips in active:
+                        a = times[i]
+                        if a > limit:
+                            continue
+                        label = Label(a, trips, ready_label.stops, ('ride', ready_label, pattern, row, board_pos, i))
+                        if _insert(self.arrivals.setdefault(stop, []), label, capacity, self.penalty, removed):
+                            improved.setdefault(stop, []).append(label)
+                            if stop == target:
+                                bound = self._bound(target, deadline)
+                                limit = bound - remaining[stop]
+                    labels = new_ready.get(stop)
+                    if labels is None:
+                        continue
+                    labels = [x for x in labels if x.time <= limit]
+                    if not labels:
+                        continue
+                    column = dep[:, i]
+                    rows = column.searchsorted([x.time for x in labels])
+                    departures = column[np.minimum(rows, len(column) - 1)]
+                    for ready_label, row, d in zip(labels, rows.tolist(), departures.tolist()):
+                        if row == len(column) or d > limit:
+                            continue
+                        trip = trip_base + row
+                        bit = trip_bits.get(trip)
+                        if bit is None:
+                            bit = trip_bits[trip] = 1 << len(trip_bits)
+                        trips = ready_label.trips | bit
+                        key = (trips, ready_label.stops)
+                        if key not in boarded:
+                            boarded.add(key)
+                            active.append((row, arr[row].tolist(), i, ready_label, trips))
+                    if len(active) > capacity:
+                        active.sort(key=lambda x: (x[0], x[4].bit_count()))
+                        del active[capacity:]
+
+            # 换乘（到达终点的标签不再继续换乘）
+            new_ready = {}
+            for stop, labels in improved.items():
+                if stop == target:
+                    continue
+                for arrival_label in labels:
+                    if id(arrival_label) in removed:
+                        continue
+                    for to_stop, transfer_time in self.transfers.get(stop, ()):
+                        t = arrival_label.time + transfer_time
+                        if t + remaining[to_stop] > bound:
+                            continue
+                        label = Label(t, arrival_label.trips, arrival_label.stops + (stop,),
+                                      ('transfer', arrival_label, transfer_time))
+                        if _insert(self.ready.setdefault(to_stop, []), label, capacity, self.penalty, removed):
+                            new_ready.setdefault(to_stop, []).append(label)
+            # 同一轮中后加入的标签可能已把先加入的淘汰
+            new_ready = {stop: [x for x in labels if id(x) not in removed] for stop, labels in new_ready.items()}
+            new_ready = {stop: labels for stop, labels in new_ready.items() if labels}
+
+    def journey(self, label: Label) -> dict:
+        """由到达标签回溯完整行程"""
+        legs: List[dict] = []
+        waits: List[int] = []
+        while label.parent is not None:
+            if label.parent[0] == 'ride':
+                _, ready_label, pattern, row, board_pos, alight_pos = label.parent
+                legs.append(make_leg(self.tt, pattern, row, board_pos, alight_pos))
+                label = ready_label
+            else:
+                _, arrival_label, transfer_time = label.parent
+                waits.append(transfer_time)
+                label = arrival_label
+        legs.reverse()
+        waits.reverse()
+        return make_journey(legs, waits)
+
+    def alternatives(self, target: int, k: int) -> List[dict]:
+        """
+        从终点的标签中贪心选出 k 条行程：每次选择“到达时间 + penalty * 与已选行程的最大重合度”最小的一条，
+        所乘 trip 与换乘站都和已选行程相同的不会被选中。结果按到达时间排序。
+        """
+        candidates = sorted(self.arrivals.get(target, []), key=lambda x: (x.time, x.trips.bit_count()))
+        chosen: List[Label] = []
+        while candidates and len(chosen) < k:
+            scores = [c.time + self.penalty * max((overlap(c, x) for x in chosen), default=0.0)
+                      for c in candidates]
+            best = candidates.pop(int(np.argmin(scores)))
+            if any(best.trips == x.trips and best.stops == x.stops for x in chosen):
+                continue
+            chosen.append(best)
+        chosen.sort(key=lambda x: (x.time, x.trips.bit_count()))
+        return [self.journey(label) for label in chosen]
+
+
+def k_alternatives(tt: Timetable, transfers: Transfers, start_stop: str, end_stop: str,
+                   current_time_sec: int, k: int = 5, max_rounds: int = 5,
+                   penalty: float = 600.0, max_delay: int = 1800) -> List[dict]:
+    """
+    一次搜索返回最多 k 条互不相同（trip 或换乘站不同）的行程，结果结构同 raptor.earliest_arrival。
+
+    第一条即最早到达的行程；其余行程到达时间不晚于最早到达 max_delay 秒。
+    """
+    origin = tt.stop_idx.get(start_stop)
+    target = tt.stop_idx.get(end_stop)
+    if origin is None or target is None:
+        return []
+    search = AlternativesSearch(tt, transfers, max_rounds, labels_per_stop=k + 1,
+                                penalty=penalty, max_delay=max_delay)
+    search.run(origin, current_time_sec, target)
+    return search.alternatives(target, k)
+
+
+# 测试代码
+if __name__ == "__main__":
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    transfers = load_transfers("transfers.json", tt.stop_idx)
+    for journey in k_alternatives(tt, transfers, "de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst",
+                                  time_to_seconds("04:30:00")):
+        print(f"{journey['departure_time']} -> {journey['arrival_time']}，换乘 {journey['transfers']} 次: "
+              f"{' / '.join(leg['trip_id'] for leg in journey['legs'])}")
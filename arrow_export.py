@@ -0,0 +1,175 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from compile_timetable import ARRAY_NAMES, Timetable, expand_stop_times, load_transfers
+from raptor import Transfers
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# 分析用的表；arrays/ 目录下另有编译后数组，每个数组一个单列文件
+TABLE_NAMES = ('stops', 'trips', 'patterns', 'stop_times', 'transfers')
+ARRAYS_DIR = 'arrays'
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Arrow / Parquet 导出需要安装 pyarrow: pip install pyarrow")
+
+
+def _dictionary(indices: np.ndarray, values: List[str]) -> 'pa.DictionaryArray':
+    """索引即时刻表中的编号，字典即 stop_id / trip_id 列表，分析时读到的仍是字符串列"""
+    return pa.DictionaryArray.from_arrays(pa.array(indices.astype(np.int32)), pa.array(values, pa.string()))
+
+
+def _write_ipc(table: 'pa.Table', path: str) -> None:
+    # 不压缩、单个 record batch，读取时可直接内存映射为连续的 NumPy 数组
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+
+
+def _read_ipc(path: str) -> 'pa.Table':
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def timetable_tables(tt: Timetable, transfers: Transfers) -> Dict[str, 'pa.Table']:
+    """
+    将编译后的时刻表展开为分析用的表。
+
+    返回:
+        Dict[str, pa.Table]:
+            'stops': stop_index, stop_id
+            'trips': trip_index, trip_id, pattern, start_sec
+            'patterns': pattern, position, stop_id（pattern 的停站序列，长表）
+            'stop_times': trip_id, position, stop_id, arrival_sec, departure_sec（时间为整数秒）
+            'transfers': from_stop_id, to_stop_id, transfer_sec
+    """
+    _require_pyarrow()
+    trip, pos, stop, arr, dep = expand_stop_times(tt)
+    pattern_lengths = np.diff(tt.pattern_stop_offsets)
+    pattern_pos = np.arange(len(tt.pattern_stops)) - np.repeat(tt.pattern_stop_offsets[:-1], pattern_lengths)
+    from_stops = [s for s, edges in transfers.items() for _ in edges]
+    edges = [edge for s in transfers for edge in transfers[s]]
+
+    return {
+        'stops': pa.table({
+            'stop_index': pa.array(np.arange(tt.n_stops, dtype=np.int32)),
+            'stop_id': pa.array(tt.stop_ids, pa.string()),
+        }),
+        'trips': pa.table({
+            'trip_index': pa.array(np.arange(tt.n_trips, dtype=np.int32)),
+            'trip_id': pa.array(tt.trip_ids, pa.string()),
+            'pattern': pa.array(tt.trip_pattern.astype(np.int32)),
+            'start_sec': pa.array(tt.trip_start.astype(np.int32)),
+        }),
+        'patterns': pa.table({
+            'pattern': pa.array(np.repeat(np.arange(tt.n_patterns, dtype=np.int32), pattern_lengths)),
+            'position': pa.array(pattern_pos.astype(np.int32)),
+            'stop_id': _dictionary(tt.pattern_stops, tt.stop_ids),
+        }),
+        'stop_times': pa.table({
+            'trip_id': _dictionary(trip, tt.trip_ids),
+            'position': pa.array(pos.astype(np.int32)),
+            'stop_id': _dictionary(stop, tt.stop_ids),
+            'arrival_sec': pa.array(arr.astype(np.int32)),
+            'departure_sec': pa.array(dep.astype(np.int32)),
+        }),
+        'transfers': pa.table({
+            'from_stop_id': _dictionary(np.array(from_stops, dtype=np.int64), tt.stop_ids),
+            'to_stop_id': _dictionary(np.array([to for to, _ in edges], dtype=np.int64), tt.stop_ids),
+            'transfer_sec': pa.array(np.array([t for _, t in edges], dtype=np.int32)),
+        }),
+    }
+
+
+def export_timetable(tt: Timetable, transfers: Transfers, output_dir: str, parquet: bool = True) -> List[str]:
+    """
+    将编译后的时刻表导出为 Arrow IPC（.arrow）文件，可选同时导出 Parquet（.parquet）。
+
+    - <表名>.arrow / .parquet: 分析用的表（见 timetable_tables），id 列为字典编码；
+    - arrays/<数组名>.arrow: 编译后的数组原样保存，load_timetable_arrow 通过内存映射零拷贝加载。
+
+    Parquet 是压缩的列式格式，适合 pandas / DuckDB 等分析工具；路由服务读取 Arrow IPC 文件。
+
+    参数:
+        tt (Timetable): 编译后的时刻表
+        transfers (Transfers): load_transfers 返回的换乘表
+        output_dir (str): 输出目录
+        parquet (bool): 是否同时写出 Parquet 文件
+
+    返回:
+        List[str]: 写出的文件路径
+    """
+    _require_pyarrow()
+    os.makedirs(os.path.join(output_dir, ARRAYS_DIR), exist_ok=True)
+    paths = []
+    for name, table in timetable_tables(tt, transfers).items():
+        path = os.path.join(output_dir, f"{name}.arrow")
+        _write_ipc(table, path)
+        paths.append(path)
+        if parquet:
+            path = os.path.join(output_dir, f"{name}.parquet")
+            pq.write_table(table, path)
+            paths.append(path)
+    for name in ARRAY_NAMES:
+        path = os.path.join(output_dir, ARRAYS_DIR, f"{name}.arrow")
+        _write_ipc(pa.table({name: pa.array(getattr(tt, name))}), path)
+        paths.append(path)
+    return paths
+
+
+def load_timetable_arrow(directory: str) -> Timetable:
+    """
+    通过内存映射加载 export_timetable 导出的时刻表。
+
+    数组直接引用映射的文件内容，不复制到进程内存；多个进程加载同一目录时共享操作系统的页缓存。
+    """
+    _require_pyarrow()
+    arrays = {}
+    for name in ARRAY_NAMES:
+        column = _read_ipc(os.path.join(directory, ARRAYS_DIR, f"{name}.arrow")).column(0)
+        if column.num_chunks and len(column):
+            arrays[name] = column.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            arrays[name] = np.zeros(0, dtype=column.type.to_pandas_dtype())
+    stop_ids = _read_ipc(os.path.join(directory, 'stops.arrow')).column('stop_id').to_pylist()
+    trip_ids = _read_ipc(os.path.join(directory, 'trips.arrow')).column('trip_id').to_pylist()
+    return Timetable(arrays, stop_ids, trip_ids)
+
+
+def load_transfers_arrow(directory: str, stop_idx: Dict[str, int]) -> Transfers:
+    """读取导出的 transfers 表，结果与 load_transfers 相同"""
+    _require_pyarrow()
+    table = _read_ipc(os.path.join(directory, 'transfers.arrow'))
+    transfers: Transfers = {}
+    for from_stop, to_stop, transfer_time in zip(table.column('from_stop_id').to_pylist(),
+                                                 table.column('to_stop_id').to_pylist(),
+                                                 table.column('transfer_sec').to_pylist()):
+        transfers.setdefault(stop_idx[from_stop], []).append((stop_idx[to_stop], transfer_time))
+    return transfers
+
+
+# 测试代码
+if __name__ == "__main__":
+    import time
+
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    transfers = load_transfers("transfers.json", tt.stop_idx)
+    for path in export_timetable(tt, transfers, "timetable_arrow"):
+        print(f"已保存 {path}")
+
+    start = time.time()
+    mapped = load_timetable_arrow("timetable_arrow")
+    print(f"内存映射加载用时 {time.time() - start:.3f} 秒，trip 数量: {mapped.n_trips}")
+
+    # 分析端：直接读取 Parquet，无需重新解析 stop_times.txt
+    import pandas as pd
+    stop_times = pd.read_parquet("timetable_arrow/stop_times.parquet")
+    print(stop_times.head())
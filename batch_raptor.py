@@ -0,0 +1,148 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from compile_timetable import Timetable, load_transfers, time_to_seconds
+from raptor import INF, Transfers
+
+# 每批同时计算的场景数量
+LANES = 64
+
+
+class BatchRaptorSearch:
+    """
+    多场景并行的 one-to-all RAPTOR：每个站点的标签是长度为场景数的向量，
+    扫描 pattern 与换乘时所有场景一起用向量化的 min / 比较更新。
+
+    与 RaptorSearch 相同，换车只能通过 transfers.json 中的记录（包括同站换乘）进行；
+    不同场景可以有不同的起点和出发时间。只计算最早到达时间，不回溯行程。
+    """
+
+    def __init__(self, tt: Timetable, transfers: Transfers, max_rounds: int = 5):
+        self.tt = tt
+        self.max_rounds = max_rounds
+        # 换乘表转为 CSR 数组，换乘步骤对所有被改进站点的换乘边一次性计算
+        counts = np.zeros(tt.n_stops, dtype=np.int64)
+        for stop, edges in transfers.items():
+            counts[stop] = len(edges)
+        self.transfer_offsets = np.zeros(tt.n_stops + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.transfer_offsets[1:])
+        self.transfer_to = np.zeros(self.transfer_offsets[-1], dtype=np.int64)
+        self.transfer_time = np.zeros(self.transfer_offsets[-1], dtype=np.int64)
+        for stop, edges in transfers.items():
+            lo = self.transfer_offsets[stop]
+            self.transfer_to[lo:lo + len(edges)] = [to_stop for to_stop, _ in edges]
+            self.transfer_time[lo:lo + len(edges)] = [transfer_time for _, transfer_time in edges]
+        # 同一站点出现多次的 pattern（环线）需要用 np.minimum.at 更新
+        self._has_loop: Dict[int, bool] = {}
+
+    def _is_loop(self, pattern: int) -> bool:
+        loop = self._has_loop.get(pattern)
+        if loop is None:
+            stops = self.tt.pattern_stops_of(pattern)
+            loop = self._has_loop[pattern] = len(np.unique(stops)) < len(stops)
+        return loop
+
+    def run(self, origins: Sequence[int], dep_secs: Sequence[int]) -> np.ndarray:
+        """
+        参数:
+            origins (Sequence[int]): 各场景的起点站点索引
+            dep_secs (Sequence[int]): 各场景的出发时间（秒）
+
+        返回:
+            np.ndarray: 形状为 (站点数, 场景数) 的最早乘车到达时间，不可达为 INF
+        """
+        tt = self.tt
+        lanes = len(origins)
+        lane_idx = np.arange(lanes)
+        # arrival[s, l]: 场景 l 乘车到达 s 的最早时间；ready[s, l]: 场景 l 可在 s 上车的最早时间
+        self.arrival = np.full((tt.n_stops, lanes), INF, dtype=np.int64)
+        self.ready = np.full((tt.n_stops, lanes), INF, dtype=np.int64)
+        np.minimum.at(self.ready, (np.asarray(origins), lane_idx), np.asarray(dep_secs, dtype=np.int64))
+        arrival, ready = self.arrival, self.ready
+        marked = set(int(o) for o in origins)
+
+        for _ in range(self.max_rounds):
+            if not marked:
+                break
+            queue = {}
+            for stop in marked:
+                patterns, positions = tt.patterns_at_stop(stop)
+                for pattern, pos in zip(patterns.tolist(), positions.tolist()):
+                    if pos < queue.get(pattern, INF):
+                        queue[pattern] = pos
+
+            improved = set()
+            for pattern, first_pos in queue.items():
+                stops = tt.pattern_stops_of(pattern)[first_pos:]
+                arr, dep = tt.pattern_times(pattern)
+                arr, dep = arr[:, first_pos:], dep[:, first_pos:]
+                n, length = dep.shape
+                # 各位置、各场景能赶上的第一趟车（n 表示赶不上），对位置取前缀最小值即为该处乘坐的车次：
+                # pattern 内不超车，更早的车次在之后每一站都更早
+                catchable = (dep[:, :, None] < ready[stops][None, :, :]).sum(axis=0)
+                rows = np.minimum.accumulate(catchable, axis=0)
+                # 在位置 i 下车使用的是位置 i 之前上车的车次
+                rows = np.vstack([np.full((1, lanes), n), rows[:-1]])
+                a = np.where(rows < n, arr[np.minimum(rows, n - 1), np.arange(length)[:, None]], INF)
+                current = arrival[stops]
+                better = (a < current).any(axis=1)
+                if better.any():
+                    if self._is_loop(pattern):
+                        np.minimum.at(arrival, stops, a)
+                    else:
+                        arrival[stops] = np.minimum(current, a)
+                    improved.update(stops[better].tolist())
+
+            # 换乘
+            if not improved:
+                break
+            sources = np.fromiter(improved, dtype=np.int64, count=len(improved))
+            counts = self.transfer_offsets[sources + 1] - self.transfer_offsets[sources]
+            total = int(counts.sum())
+            edges = np.repeat(self.transfer_offsets[sources] - np.cumsum(counts) + counts, counts) + np.arange(total)
+            to_stops = self.transfer_to[edges]
+            t = arrival[np.repeat(sources, counts)] + self.transfer_time[edges][:, None]
+            better = (t < ready[to_stops]).any(axis=1)
+            np.minimum.at(ready, to_stops[better], t[better])
+            marked = set(to_stops[better].tolist())
+        return arrival
+
+
+def batch_earliest_arrival(tt: Timetable, transfers: Transfers, origins: Sequence[int],
+                           dep_secs: Sequence[int], max_rounds: int = 5, lanes: int = LANES) -> np.ndarray:
+    """
+    批量 one-to-all 最早到达查询，每 lanes 个场景并行计算一次。
+
+    参数:
+        origins (Sequence[int]): 各场景的起点站点索引（长度为 1 时所有场景共用同一个起点）
+        dep_secs (Sequence[int]): 各场景的出发时间（秒）
+
+    返回:
+        np.ndarray: 形状为 (站点数, 场景数) 的最早乘车到达时间，不可达为 INF
+    """
+    if len(origins) == 1:
+        origins = list(origins) * len(dep_secs)
+    search = BatchRaptorSearch(tt, transfers, max_rounds)
+    results: List[np.ndarray] = []
+    for lo in range(0, len(dep_secs), lanes):
+        results.append(search.run(origins[lo:lo + lanes], dep_secs[lo:lo + lanes]))
+    return np.concatenate(results, axis=1) if results else np.zeros((tt.n_stops, 0), dtype=np.int64)
+
+
+# 测试代码
+if __name__ == "__main__":
+    import time
+
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    transfers = load_transfers("transfers.json", tt.stop_idx)
+    origin = tt.stop_idx["de:09162:40:51:51-Hst"]
+    # 07:00 - 08:03 每分钟出发一次
+    dep_secs = [time_to_seconds("07:00:00") + 60 * i for i in range(64)]
+
+    start = time.time()
+    arrival = batch_earliest_arrival(tt, transfers, [origin], dep_secs)
+    print(f"64 个出发时间计算完成，用时 {time.time() - start:.2f} 秒")
+    target = tt.stop_idx["de:09162:1140:51:51-Hst"]
+    travel = np.where(arrival[target] < INF, arrival[target] - np.array(dep_secs), -1)
+    print(f"到达 {tt.stop_ids[target]} 的行程时间（秒）: {travel.tolist()}")
@@ -0,0 +1,394 @@
+import csv
+import heapq
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import zipfile
+import zlib
+from bisect import bisect_left
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from compile_timetable import time_to_seconds
+
+# 原始行: (trip_id, stop_sequence, stop_id, arrival_time, departure_time)
+Row = Tuple[str, int, str, str, str]
+
+
+def shard_of(trip_id: str, n_shards: int) -> int:
+    """按 trip_id 的哈希分片（crc32 与进程、Python 版本无关，保证结果可复现）"""
+    return zlib.crc32(trip_id.encode('utf-8')) % n_shards
+
+
+def _chunk_ranges(file_path: str, n_chunks: int) -> List[Tuple[int, int]]:
+    """将文件（不含表头）按字节切分为 n_chunks 段，每段边界都落在行首"""
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        f.readline()
+        data_start = f.tell()
+        bounds = [data_start]
+        for i in range(1, n_chunks):
+            f.seek(max(data_start + (size - data_start) * i // n_chunks, bounds[-1]))
+            if f.tell() > data_start:
+                f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+        bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(n_chunks) if bounds[i] < bounds[i + 1]]
+
+
+def _read_header(file_path: str) -> List[str]:
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        return next(csv.reader(f))
+
+
+def _split_chunk(args: Tuple[str, List[str], int, int, int, str]) -> Tuple[str, List[int]]:
+    """
+    子进程：解析文件的一段，按 shard_of 分桶写入 rows_<start>.pkl。
+
+    各分片的行依次 pickle 写入同一个文件，返回文件路径与各分片的起始字节（共 n_shards + 1 个），
+    构建时每个进程只读取自己负责的分片。没有引号的段直接按逗号切分，含引号的段交给 csv 模块解析。
+    """
+    file_path, header, start, end, n_shards, work_dir = args
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    col = {name: i for i, name in enumerate(header)}
+    trip_col, seq_col, stop_col = col['trip_id'], col['stop_sequence'], col['stop_id']
+    arr_col, dep_col = col['arrival_time'], col['departure_time']
+    if '"' in text:
+        records = csv.reader(io.StringIO(text))
+    else:
+        records = (line.split(',') for line in text.replace('\r\n', '\n').split('\n'))
+    buckets: List[List[Row]] = [[] for _ in range(n_shards)]
+    # 同一 trip 有几十行，每个 trip_id 只计算一次哈希
+    trip_shard: Dict[str, int] = {}
+    for row in records:
+        if len(row) <= 1:
+            continue
+        trip_id = row[trip_col]
+        shard = trip_shard.get(trip_id)
+        if shard is None:
+            shard = trip_shard[trip_id] = shard_of(trip_id, n_shards)
+        buckets[shard].append((trip_id, int(row[seq_col]), row[stop_col], row[arr_col], row[dep_col]))
+
+    path = os.path.join(work_dir, f"rows_{start}.pkl")
+    offsets = [0]
+    with open(path, 'wb') as out:
+        for rows in buckets:
+            pickle.dump(rows, out, protocol=pickle.HIGHEST_PROTOCOL)
+            offsets.append(out.tell())
+    return path, offsets
+
+
+def _read_rows(chunks: List[Tuple[str, List[int]]], shards: List[int]) -> List[Row]:
+    """从各段的分桶文件中读取指定分片的行"""
+    rows: List[Row] = []
+    for path, offsets in chunks:
+        with open(path, 'rb') as f:
+            for shard in shards:
+                f.seek(offsets[shard])
+                rows.extend(pickle.load(f))
+    return rows
+
+
+def _build_worker(args: Tuple[List[Tuple[str, List[int]]], List[int], str, bool]) -> dict:
+    """
+    子进程：构建一组分片，结果按排序写成磁盘上的片段文件，只把文件路径与站点索引返回给主进程。
+
+    - trips_<n>.txt: 每行 "<trip_id 的 JSON>\\t<trips.json 中该 trip 的片段>"，按 trip_id 排序；
+    - stop_index_<n>.txt: 每行 "<stop_id 的 JSON>\\t<该站点记录的 JSON>\\t<从该站点出发的边 [[to_stop, 单跳最小行驶时间], ...]>"，
+      按 stop_id 排序，记录按 (trip_id, 序号) 排序；
+    - relations_<n>.pkl: 线路关系（仅在 relations 为 True 时写出），按 trip_id 排序。
+    """
+    chunks, shards, work_dir, with_relations = args
+    name = str(shards[0])
+    by_trip: Dict[str, List[Row]] = {}
+    for row in _read_rows(chunks, shards):
+        by_trip.setdefault(row[0], []).append(row)
+
+    paths = {key: os.path.join(work_dir, f"{key}_{name}.{ext}")
+             for key, ext in (('trips', 'txt'), ('stop_index', 'txt'), ('relations', 'pkl'))}
+    stop_index: Dict[str, List[list]] = {}
+    edges: Dict[Tuple[str, str], int] = {}
+    relations: List[dict] = []
+    trip_ids = sorted(by_trip)
+    trip_offsets = [0]
+    with open(paths['trips'], 'wb') as trips_file:
+        for trip_id in trip_ids:
+            records = sorted(by_trip.pop(trip_id), key=lambda x: x[1])
+            trip_list = []
+            for idx, (_, seq, stop_id, arr_time, dep_time) in enumerate(records):
+                record = {
+                    'stop_id': stop_id,
+                    'arrival_time': arr_time,
+                    'departure_time': dep_time,
+                    'stop_sequence': seq,
+                    'departure_sec': time_to_seconds(dep_time),
+                    'arrival_sec': time_to_seconds(arr_time)
+                }
+                trip_list.append(record)
+                stop_index.setdefault(stop_id, []).append([trip_id, idx, record['departure_sec'], record['arrival_sec']])
+                if idx > 0:
+                    prev = trip_list[idx - 1]
+                    travel_time = record['arrival_sec'] - prev['departure_sec']
+                    key = (prev['stop_id'], stop_id)
+                    if travel_time < edges.get(key, travel_time + 1):
+                        edges[key] = travel_time
+                    if with_relations:
+                        relations.append({
+                            "from_stop": prev['stop_id'],
+                            "to_stop": stop_id,
+                            "trip_id": trip_id,
+                            "departure_time": prev['departure_time'],
+                            "arrival_time": arr_time,
+                            "travel_time": travel_time
+                        })
+            key = json.dumps(trip_id)
+            trips_file.write((key + '\t' + key + ': ' + json.dumps(trip_list) + '\n').encode('utf-8'))
+            trip_offsets.append(trips_file.tell())
+
+    out_edges: Dict[str, List[list]] = {}
+    for from_stop, to_stop in sorted(edges):
+        out_edges.setdefault(from_stop, []).append([to_stop, edges[(from_stop, to_stop)]])
+
+    # 记录每个站点在片段文件中的起始字节，合并时各进程只读取自己负责的站点区间
+    stop_ids = sorted(stop_index)
+    offsets = [0]
+    with open(paths['stop_index'], 'wb') as index_file:
+        for stop_id in stop_ids:
+            line = '\t'.join((json.dumps(stop_id), json.dumps(stop_index[stop_id]), json.dumps(out_edges.get(stop_id, []))))
+            index_file.write((line + '\n').encode('utf-8'))
+            offsets.append(index_file.tell())
+    if with_relations:
+        with open(paths['relations'], 'wb') as relations_file:
+            pickle.dump(relations, relations_file, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        paths['relations'] = None
+    paths['trip_ids'] = trip_ids
+    paths['trip_offsets'] = trip_offsets
+    paths['stop_ids'] = stop_ids
+    paths['stop_offsets'] = offsets
+    return paths
+
+
+def _merge_stop_range(args: Tuple[str, int, int, List[Tuple[str, int, int]], str]) -> Tuple[str, str]:
+    """
+    子进程：合并排序后第 lo..hi 个站点，写出 stop_index.json 的对应片段与邻接矩阵的对应行（float64 原始字节）。
+
+    spans 为各片段文件中这段站点所在的字节范围 (路径, 起始, 结束)。
+    """
+    stops_path, lo, hi, spans, work_dir = args
+    with open(stops_path, 'r', encoding='utf-8') as f:
+        stops = json.load(f)
+    stop_to_index = {stop: idx for idx, stop in enumerate(stops)}
+    entries: List[List[str]] = [[] for _ in range(hi - lo)]
+    src, dst, weights = [], [], []
+    for path, start, end in spans:
+        for line in _read_span(path, start, end):
+            key, stop_entries, stop_edges = line.split('\t', 2)
+            row = stop_to_index[json.loads(key)] - lo
+            entries[row].append(stop_entries)
+            for to_stop, travel_time in json.loads(stop_edges):
+                src.append(row)
+                dst.append(stop_to_index[to_stop])
+                weights.append(travel_time)
+
+    index_path = os.path.join(work_dir, f"stop_index_part_{lo}.json")
+    with open(index_path, 'w', encoding='utf-8') as out:
+        for row, parts in enumerate(entries):
+            if len(parts) == 1:
+                # 只出现在一个片段中的站点，记录已按顺序编码，直接拷贝
+                merged = parts[0]
+            else:
+                merged = json.dumps(list(heapq.merge(*(json.loads(part) for part in parts), key=lambda x: (x[0], x[1]))))
+            out.write((', ' if row else '') + json.dumps(stops[lo + row]) + ': ' + merged)
+
+    # 邻接矩阵 lo..hi 行：各片段的边取最小值
+    block = np.full((hi - lo, len(stops)), np.inf)
+    if weights:
+        np.minimum.at(block, (np.array(src), np.array(dst)), np.array(weights, dtype=np.float64))
+    matrix_path = os.path.join(work_dir, f"adjacency_part_{lo}.bin")
+    with open(matrix_path, 'wb') as out:
+        out.write(block.tobytes())
+    return index_path, matrix_path
+
+
+def _read_span(path: str, start: int, end: int) -> List[str]:
+    """读取片段文件中 [start, end) 字节范围内的各行"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf-8').split('\n')[:-1]
+
+
+def _merge_trip_range(args: Tuple[List[Tuple[str, int, int]], int, str]) -> str:
+    """子进程：对各片段中同一段 trip_id 区间的行做 k 路归并，写出 trips.json 的对应片段"""
+    spans, lo, work_dir = args
+    lines = []
+    for path, start, end in spans:
+        lines.append([(json.loads(key), fragment) for key, fragment in
+                      (line.split('\t', 1) for line in _read_span(path, start, end))])
+    trips_path = os.path.join(work_dir, f"trips_part_{lo}.json")
+    with open(trips_path, 'w', encoding='utf-8') as out:
+        out.write(', '.join(fragment for _, fragment in heapq.merge(*lines, key=lambda x: x[0])))
+    return trips_path
+
+
+def _range_spans(fragments: List[dict], ids: List[str], n_ranges: int,
+                 path_key: str, ids_key: str, offsets_key: str) -> List[Tuple[int, int, List[Tuple[str, int, int]]]]:
+    """
+    将排序后的 ids 切分为最多 n_ranges 段连续区间。
+
+    各片段按 id 排序，每个区间在片段文件中是一段连续字节；返回 (lo, hi, [(片段路径, 起始字节, 结束字节), ...])。
+    """
+    n_ranges = min(len(ids), n_ranges)
+    bounds = [len(ids) * i // n_ranges for i in range(n_ranges + 1)] if n_ranges else []
+    ranges = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        spans = []
+        for fragment in fragments:
+            first = bisect_left(fragment[ids_key], ids[lo])
+            last = bisect_left(fragment[ids_key], ids[hi]) if hi < len(ids) else len(fragment[ids_key])
+            if first < last:
+                spans.append((fragment[path_key], fragment[offsets_key][first], fragment[offsets_key][last]))
+        ranges.append((lo, hi, spans))
+    return ranges
+
+
+def _write_object(path: str, parts: List[str]) -> None:
+    """把各段 "键: 值" 片段按顺序拼接为一个 JSON 对象"""
+    with open(path, 'wb') as file:
+        file.write(b'{')
+        for i, part in enumerate(parts):
+            if i:
+                file.write(b', ')
+            _copy_file(part, file)
+        file.write(b'}')
+
+
+def _copy_file(path: str, dest) -> None:
+    with open(path, 'rb') as src:
+        shutil.copyfileobj(src, dest)
+
+
+def _save_matrix_npz(path: str, name: str, n: int, parts: List[str]) -> None:
+    """
+    把按行分段的 float64 原始字节流式写入 npz，不在内存中拼出整个矩阵。
+
+    与 np.savez 格式相同，并固定压缩包内的时间戳，保证相同数据得到相同字节。
+    """
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {
+        'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)), 'fortran_order': False, 'shape': (n, n)})
+    info = zipfile.ZipInfo(name + '.npy', date_time=(1980, 1, 1, 0, 0, 0))
+    info.file_size = len(header.getvalue()) + sum(os.path.getsize(part) for part in parts)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as zf:
+        with zf.open(info, 'w') as dest:
+            dest.write(header.getvalue())
+            for part in parts:
+                _copy_file(part, dest)
+
+
+def build_shards(file_path: str, work_dir: str, workers: Optional[int] = None, n_shards: int = 64,
+                 relations: bool = False) -> List[dict]:
+    """
+    多进程按 trip_id 哈希分片构建，结果写入 work_dir 下的片段文件。
+
+    输入文件按行对齐的字节范围切分，每段只由一个进程解析一次，按 shard_of 分桶写入磁盘；
+    随后每个进程负责固定的一组分片，只读取这些分片的桶并完成构建。原始行不经过主进程。
+    分片数量与进程数无关，合并后的输出与进程数无关。
+
+    参数:
+        file_path (str): stop_times.txt 文件的路径
+        work_dir (str): 片段文件的输出目录
+        workers (Optional[int]): 进程数，默认使用全部 CPU
+        n_shards (int): 分片数量
+        relations (bool): 是否同时写出线路关系（process_stop_times_parallel 使用）
+
+    返回:
+        List[dict]: 每个进程的片段文件路径与站点索引，供 merge_shards 使用
+    """
+    header = _read_header(file_path)
+    n_workers = max(1, min(workers or os.cpu_count() or 1, n_shards))
+    split_tasks = [(file_path, header, start, end, n_shards, work_dir)
+                   for start, end in _chunk_ranges(file_path, n_workers * 4)]
+    with Pool(processes=n_workers) as pool:
+        chunks = pool.map(_split_chunk, split_tasks)
+        fragments = pool.map(_build_worker, [(chunks, list(range(w, n_shards, n_workers)), work_dir, relations)
+                                             for w in range(n_workers)])
+    for path, _ in chunks:
+        os.remove(path)
+    return fragments
+
+
+def merge_shards(fragments: List[dict], output_dir: str = '.', workers: Optional[int] = None) -> None:
+    """
+    确定性地合并各片段，输出 trips.json、stop_index.json、stop_times_adjacency.npz 与 stop_mapping.json。
+
+    所有输出都按 trip_id / stop_id 排序，与分片和进程数量无关。排序后的 trip_id / stop_id 切分为若干区间，
+    由子进程对各片段中对应的字节范围做 k 路归并，主进程只按顺序拼接各段文件，不重建字典或矩阵。
+    """
+    work_dir = os.path.dirname(fragments[0]['trips'])
+    n_workers = max(1, workers or os.cpu_count() or 1)
+    trip_ids = sorted(trip_id for fragment in fragments for trip_id in fragment['trip_ids'])
+    stops = sorted(set().union(*(fragment['stop_ids'] for fragment in fragments)))
+    stops_path = os.path.join(work_dir, "stops.json")
+    with open(stops_path, 'w', encoding='utf-8') as f:
+        json.dump(stops, f)
+
+    trip_tasks = [(spans, lo, work_dir) for lo, _, spans in
+                  _range_spans(fragments, trip_ids, n_workers * 4, 'trips', 'trip_ids', 'trip_offsets')]
+    stop_tasks = [(stops_path, lo, hi, spans, work_dir) for lo, hi, spans in
+                  _range_spans(fragments, stops, n_workers * 4, 'stop_index', 'stop_ids', 'stop_offsets')]
+    with Pool(processes=n_workers) as pool:
+        trip_parts = pool.map_async(_merge_trip_range, trip_tasks)
+        parts = pool.map(_merge_stop_range, stop_tasks)
+        trip_parts = trip_parts.get()
+
+    # trips.json: 结果与 json.dumps(按 trip_id 排序的字典) 相同
+    _write_object(os.path.join(output_dir, "trips.json"), trip_parts)
+    # stop_index.json: 与 preprocess.py 中 groupby 的顺序一致
+    _write_object(os.path.join(output_dir, "stop_index.json"), [index_path for index_path, _ in parts])
+
+    # 单跳最小行驶时间邻接矩阵，与 preprocess_stop_times_to_numpy_matrix 的输出格式相同
+    _save_matrix_npz(os.path.join(output_dir, "stop_times_adjacency.npz"), 'adjacency', len(stops),
+                     [matrix_path for _, matrix_path in parts])
+    stop_to_index = {stop: idx for idx, stop in enumerate(stops)}
+    with open(os.path.join(output_dir, "stop_mapping.json"), 'w', encoding='utf-8') as f:
+        json.dump(stop_to_index, f, ensure_ascii=False, indent=4)
+
+
+def build_parallel(file_path: str, output_dir: str = '.', workers: Optional[int] = None, n_shards: int = 64) -> None:
+    """构建并合并，片段文件写在 output_dir 下的临时目录中，完成后删除"""
+    with tempfile.TemporaryDirectory(dir=output_dir) as work_dir:
+        fragments = build_shards(file_path, work_dir, workers, n_shards)
+        merge_shards(fragments, output_dir, workers)
+
+
+def process_stop_times_parallel(file_path: str, workers: Optional[int] = None,
+                                n_shards: int = 64) -> Tuple[List[str], List[dict]]:
+    """与 tograph.process_stop_times 返回相同结构 (站点列表, 线路关系)，站点与关系按 trip_id 排序"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        fragments = build_shards(file_path, work_dir, workers, n_shards, relations=True)
+        shard_relations = []
+        for fragment in fragments:
+            with open(fragment['relations'], 'rb') as f:
+                shard_relations.append(pickle.load(f))
+    relations = list(heapq.merge(*shard_relations, key=lambda rel: rel['trip_id']))
+    all_stops = sorted(set().union(*(fragment['stop_ids'] for fragment in fragments)))
+    return all_stops, relations
+
+
+# 主程序
+if __name__ == "__main__":
+    import time
+
+    stop_times_file = "raw_file/stop_times.txt"
+
+    start = time.time()
+    build_parallel(stop_times_file)
+    print(f"构建完成，用时 {time.time() - start:.1f} 秒")
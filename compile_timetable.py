@@ -0,0 +1,447 @@
+import csv
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 单个 trip 的原始记录: [(stop_id, arrival_sec, departure_sec), ...]，按 stop_sequence 升序
+TripRecords = List[Tuple[str, int, int]]
+
+# 持久化到 .npz 的数组名称
+ARRAY_NAMES = (
+    'pattern_stop_offsets', 'pattern_stops', 'pattern_trip_offsets',
+    'profile_offsets', 'profile_arr', 'profile_dep',
+    'trip_pattern', 'trip_profile', 'trip_start',
+    'exc_offsets', 'exc_pos', 'exc_arr', 'exc_dep',
+)
+
+
+def time_to_seconds(time_str: str) -> int:
+    """将 HH:MM:SS 格式的时间转换为秒"""
+    h, m, s = map(int, time_str.split(':'))
+    return h * 3600 + m * 60 + s
+
+
+def seconds_to_time(seconds: int) -> str:
+    """将秒数转换回 HH:MM:SS 格式（允许超过 24 小时）"""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+
+def read_stop_times(file_path: str) -> Dict[str, TripRecords]:
+    """
+    读取 stop_times.txt，按 trip_id 分组并按 stop_sequence 排序。
+
+    参数:
+        file_path (str): stop_times.txt 文件的路径
+
+    返回:
+        Dict[str, TripRecords]: trip_id -> [(stop_id, arrival_sec, departure_sec), ...]
+    """
+    rows: Dict[str, List[Tuple[int, str, int, int]]] = {}
+    # utf-8-sig 会自动去掉文件头的 BOM
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            rows.setdefault(row['trip_id'], []).append((
+                int(row['stop_sequence']),
+                row['stop_id'],
+                time_to_seconds(row['arrival_time']),
+                time_to_seconds(row['departure_time']),
+            ))
+    trips: Dict[str, TripRecords] = {}
+    for trip_id, records in rows.items():
+        records.sort(key=lambda x: x[0])
+        trips[trip_id] = [(stop_id, arr, dep) for _, stop_id, arr, dep in records]
+    return trips
+
+
+def load_trips_json(file_path: str) -> Dict[str, TripRecords]:
+    """从 preprocess.py 生成的 trips.json 读取 trip 数据，转换为与 read_stop_times 相同的结构"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    return {
+        trip_id: [(r['stop_id'], r['arrival_sec'], r['departure_sec']) for r in records]
+        for trip_id, records in raw.items()
+    }
+
+
+def load_transfers(file_path: str, stop_idx: Dict[str, int]) -> Dict[int, List[Tuple[int, int]]]:
+    """
+    读取 transfers.json（键格式 "A to B"），转换为以站点索引表示的换乘邻接表。
+
+    参数:
+        file_path (str): transfers.json 文件的路径
+        stop_idx (Dict[str, int]): stop_id -> 站点索引
+
+    返回:
+        Dict[int, List[Tuple[int, int]]]: from 站点索引 -> [(to 站点索引, 换乘时间秒), ...]
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    transfers: Dict[int, List[Tuple[int, int]]] = {}
+    for key, transfer_time in raw.items():
+        parts = key.split(" to ")
+        if len(parts) != 2:
+            continue
+        from_idx = stop_idx.get(parts[0])
+        to_idx = stop_idx.get(parts[1])
+        # 时刻表中没有车辆经过的站点不参与路由
+        if from_idx is None or to_idx is None:
+            continue
+        transfers.setdefault(from_idx, []).append((to_idx, int(transfer_time)))
+    for edges in transfers.values():
+        edges.sort()
+    return transfers
+
+
+def _csr_offsets(lengths: List[int]) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def compile_timetable(trips: Dict[str, TripRecords], max_exceptions: int = 2) -> 'Timetable':
+    """
+    将 trip 记录编译为按线路模式（pattern）去重、增量编码的列式时刻表。
+
+    - 停站序列相同且互不超车的 trip 归为同一个 pattern，共享一份停站序列；
+      同一停站序列中出现超车的 trip 会拆分到新的 pattern，保证每个 pattern 内按出发时间排序后
+      各站的到/发时间都单调不减（路由时可以直接二分查找）。
+    - 每个 trip 只保存首站出发时间 trip_start 和一个运行时间模板（profile，相对首站出发的偏移）。
+    - 与已有模板只有不超过 max_exceptions 个站点不同的 trip 复用该模板，差异部分作为例外单独保存。
+
+    参数:
+        trips (Dict[str, TripRecords]): read_stop_times / load_trips_json 的结果
+        max_exceptions (int): 单个 trip 允许记录的最大例外站点数，超过则新建模板
+
+    返回:
+        Timetable: 编译后的时刻表
+    """
+    stop_ids = sorted({stop_id for records in trips.values() for stop_id, _, _ in records})
+    stop_idx = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+
+    # 按停站序列分组（trip_id 排序保证结果确定）
+    groups: Dict[Tuple[int, ...], List[Tuple[int, str, np.ndarray, np.ndarray]]] = {}
+    for trip_id in sorted(trips):
+        records = trips[trip_id]
+        if len(records) < 2:
+            continue
+        seq = tuple(stop_idx[stop_id] for stop_id, _, _ in records)
+        arr = np.array([a for _, a, _ in records], dtype=np.int32)
+        dep = np.array([d for _, _, d in records], dtype=np.int32)
+        start = int(dep[0])
+        groups.setdefault(seq, []).append((start, trip_id, arr - start, dep - start))
+
+    pattern_stops: List[Tuple[int, ...]] = []
+    pattern_trip_counts: List[int] = []
+    profiles: List[Tuple[np.ndarray, np.ndarray]] = []
+    trip_ids: List[str] = []
+    trip_pattern: List[int] = []
+    trip_profile: List[int] = []
+    trip_start: List[int] = []
+    exc_counts: List[int] = []
+    exc_pos: List[int] = []
+    exc_arr: List[int] = []
+    exc_dep: List[int] = []
+
+    for seq, members in groups.items():
+        members.sort(key=lambda m: (m[0], m[1]))
+
+        # 贪心拆分为互不超车的子 pattern：按出发时间排序后，只需与子 pattern 的最后一趟车比较
+        chains: List[List[Tuple[int, str, np.ndarray, np.ndarray]]] = []
+        for member in members:
+            start, _, rel_arr, rel_dep = member
+            for chain in chains:
+                last_start, _, last_arr, last_dep = chain[-1]
+                if (np.all(start + rel_arr >= last_start + last_arr)
+                        and np.all(start + rel_dep >= last_start + last_dep)):
+                    chain.append(member)
+                    break
+            else:
+                chains.append([member])
+
+        for chain in chains:
+            pattern = len(pattern_stops)
+            pattern_stops.append(seq)
+            pattern_trip_counts.append(len(chain))
+            # 本 pattern 的模板: (profile 全局编号, rel_arr, rel_dep)
+            local_profiles: List[Tuple[int, np.ndarray, np.ndarray]] = []
+            exact: Dict[bytes, int] = {}
+
+            for start, trip_id, rel_arr, rel_dep in chain:
+                key = rel_arr.tobytes() + rel_dep.tobytes()
+                profile = exact.get(key)
+                diff_pos = None
+                if profile is None:
+                    # 寻找差异站点最少的已有模板
+                    best = None
+                    for global_id, p_arr, p_dep in local_profiles:
+                        diff = np.flatnonzero((p_arr != rel_arr) | (p_dep != rel_dep))
+                        if best is None or len(diff) < len(best[1]):
+                            best = (global_id, diff)
+                    if best is not None and len(best[1]) <= max_exceptions:
+                        profile, diff_pos = best
+                    else:
+                        profile = len(profiles)
+                        profiles.append((rel_arr, rel_dep))
+                        local_profiles.append((profile, rel_arr, rel_dep))
+                        exact[key] = profile
+
+                trip_ids.append(trip_id)
+                trip_pattern.append(pattern)
+                trip_profile.append(profile)
+                trip_start.append(start)
+                if diff_pos is None:
+                    exc_counts.append(0)
+                else:
+                    exc_counts.append(len(diff_pos))
+                    exc_pos.extend(diff_pos.tolist())
+                    exc_arr.extend(rel_arr[diff_pos].tolist())
+                    exc_dep.extend(rel_dep[diff_pos].tolist())
+
+    arrays = {
+        'pattern_stop_offsets': _csr_offsets([len(s) for s in pattern_stops]),
+        'pattern_stops': np.array([s for seq in pattern_stops for s in seq], dtype=np.int32),
+        'pattern_trip_offsets': _csr_offsets(pattern_trip_counts),
+        'profile_offsets': _csr_offsets([len(a) for a, _ in profiles]),
+        'profile_arr': np.concatenate([a for a, _ in profiles]).astype(np.int32) if profiles
+        else np.zeros(0, dtype=np.int32),
+        'profile_dep': np.concatenate([d for _, d in profiles]).astype(np.int32) if profiles
+        else np.zeros(0, dtype=np.int32),
+        'trip_pattern': np.array(trip_pattern, dtype=np.int32),
+        'trip_profile': np.array(trip_profile, dtype=np.int32),
+        'trip_start': np.array(trip_start, dtype=np.int32),
+        'exc_offsets': _csr_offsets(exc_counts),
+        'exc_pos': np.array(exc_pos, dtype=np.int32),
+        'exc_arr': np.array(exc_arr, dtype=np.int32),
+        'exc_dep': np.array(exc_dep, dtype=np.int32),
+    }
+    return Timetable(arrays, stop_ids, trip_ids)
+
+
+def build_stop_patterns(pattern_stop_offsets: np.ndarray, pattern_stops: np.ndarray,
+                        n_stops: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """建立站点 -> (pattern, 在 pattern 中的位置) 的 CSR 索引，返回 (offsets, pattern 编号, 位置)"""
+    lengths = np.diff(pattern_stop_offsets)
+    owners = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+    positions = (np.arange(len(pattern_stops), dtype=np.int64)
+                 - np.repeat(pattern_stop_offsets[:-1], lengths)).astype(np.int32)
+    order = np.lexsort((positions, owners, pattern_stops))
+    counts = np.bincount(pattern_stops, minlength=n_stops)
+    return _csr_offsets(counts.tolist()), owners[order], positions[order]
+
+
+def expand_pattern_times(src, t_lo: int, t_hi: int, n_stops: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    由运行时间模板、首站出发时间和例外记录还原 trip [t_lo, t_hi) 的到达/出发时间矩阵。
+
+    src 需要具有 profile_offsets / profile_arr / profile_dep / trip_profile / trip_start /
+    exc_offsets / exc_pos / exc_arr / exc_dep 这些数组（Timetable 或时刻表分片）。
+    """
+    profiles = src.trip_profile[t_lo:t_hi]
+    cols = src.profile_offsets[profiles][:, None] + np.arange(n_stops)
+    starts = src.trip_start[t_lo:t_hi][:, None]
+    arr = src.profile_arr[cols] + starts
+    dep = src.profile_dep[cols] + starts
+
+    e_lo, e_hi = src.exc_offsets[t_lo], src.exc_offsets[t_hi]
+    if e_hi > e_lo:
+        counts = np.diff(src.exc_offsets[t_lo:t_hi + 1])
+        rows = np.repeat(np.arange(t_hi - t_lo), counts)
+        pos = src.exc_pos[e_lo:e_hi]
+        arr[rows, pos] = src.exc_arr[e_lo:e_hi] + starts[rows, 0]
+        dep[rows, pos] = src.exc_dep[e_lo:e_hi] + starts[rows, 0]
+    return arr, dep
+
+
+def expand_stop_times(tt: 'Timetable') -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    一次性还原全部 trip 的逐站时刻（按 trip 编号、站序排列）。
+
+    返回:
+        (trip 编号, 站序位置, 站点编号, 到达时间秒, 出发时间秒)
+    """
+    lengths = np.diff(tt.pattern_stop_offsets)[tt.trip_pattern].astype(np.int64)
+    offsets = _csr_offsets(lengths.tolist())
+    trip = np.repeat(np.arange(tt.n_trips, dtype=np.int64), lengths)
+    pos = np.arange(offsets[-1]) - offsets[trip]
+
+    cols = tt.profile_offsets[tt.trip_profile][trip] + pos
+    arr = tt.profile_arr[cols] + tt.trip_start[trip]
+    dep = tt.profile_dep[cols] + tt.trip_start[trip]
+    exc_trip = np.repeat(np.arange(tt.n_trips, dtype=np.int64), np.diff(tt.exc_offsets))
+    events = offsets[exc_trip] + tt.exc_pos
+    arr[events] = tt.exc_arr + tt.trip_start[exc_trip]
+    dep[events] = tt.exc_dep + tt.trip_start[exc_trip]
+    stop = tt.pattern_stops[tt.pattern_stop_offsets[tt.trip_pattern][trip] + pos]
+    return trip, pos, stop, arr, dep
+
+
+class Timetable:
+    """
+    按 pattern 去重、增量编码的列式时刻表。
+
+    所有 trip 按 (pattern, 首站出发时间) 排序，同一 pattern 的 trip 在全局编号中连续，
+    因此 pattern p 的 trip 就是 [pattern_trip_offsets[p], pattern_trip_offsets[p + 1])。
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], stop_ids: List[str], trip_ids: List[str],
+                 max_cached_patterns: int = 4096, stop_idx: Optional[Dict[str, int]] = None,
+                 trip_idx: Optional[Dict[str, int]] = None):
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        # 给定 stop_idx / trip_idx 时直接引用调用方的列表与字典（如 FeedRegistry），不再复制一份
+        self.stop_ids = list(stop_ids) if stop_idx is None else stop_ids
+        self.trip_ids = list(trip_ids) if trip_idx is None else trip_ids
+        self.stop_idx = stop_idx if stop_idx is not None else {
+            stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self.trip_idx = trip_idx if trip_idx is not None else {
+            trip_id: i for i, trip_id in enumerate(self.trip_ids)}
+        self.max_cached_patterns = max_cached_patterns
+        self._pattern_cache: 'OrderedDict[int, Tuple[np.ndarray, np.ndarray]]' = OrderedDict()
+        # 同一个时刻表可能被多个请求线程共享（如 walk.py），缓存的读写需要加锁
+        self._cache_lock = threading.Lock()
+        self._build_stop_patterns()
+
+    @property
+    def n_stops(self) -> int:
+        return len(self.stop_ids)
+
+    @property
+    def n_trips(self) -> int:
+        return len(self.trip_ids)
+
+    @property
+    def n_patterns(self) -> int:
+        return len(self.pattern_stop_offsets) - 1
+
+    def _build_stop_patterns(self) -> None:
+        self.stop_pattern_offsets, self.stop_pattern_ids, self.stop_pattern_pos = build_stop_patterns(
+            self.pattern_stop_offsets, self.pattern_stops, self.n_stops)
+
+    def patterns_at_stop(self, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回经过站点的 pattern 编号及该站在各 pattern 中的位置"""
+        lo, hi = self.stop_pattern_offsets[stop], self.stop_pattern_offsets[stop + 1]
+        return self.stop_pattern_ids[lo:hi], self.stop_pattern_pos[lo:hi]
+
+    def pattern_stops_of(self, pattern: int) -> np.ndarray:
+        return self.pattern_stops[self.pattern_stop_offsets[pattern]:self.pattern_stop_offsets[pattern + 1]]
+
+    def pattern_trips(self, pattern: int) -> np.ndarray:
+        return np.arange(self.pattern_trip_offsets[pattern], self.pattern_trip_offsets[pattern + 1])
+
+    def trip_times(self, trip: int) -> Tuple[np.ndarray, np.ndarray]:
+        """还原单个 trip 各站的绝对到达/出发时间（秒）"""
+        profile = self.trip_profile[trip]
+        lo, hi = self.profile_offsets[profile], self.profile_offsets[profile + 1]
+        start = self.trip_start[trip]
+        arr = self.profile_arr[lo:hi] + start
+        dep = self.profile_dep[lo:hi] + start
+        e_lo, e_hi = self.exc_offsets[trip], self.exc_offsets[trip + 1]
+        if e_hi > e_lo:
+            pos = self.exc_pos[e_lo:e_hi]
+            arr[pos] = self.exc_arr[e_lo:e_hi] + start
+            dep[pos] = self.exc_dep[e_lo:e_hi] + start
+        return arr, dep
+
+    def pattern_times(self, pattern: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        还原 pattern 内所有 trip 的到达/出发时间矩阵（形状为 trip 数 x 站点数，行按出发时间排序）。
+
+        结果按 LRU 缓存，扫描同一 pattern 时只是连续数组访问；缓存可在多个线程间共享。
+        """
+        with self._cache_lock:
+            cached = self._pattern_cache.get(pattern)
+            if cached is not None:
+                self._pattern_cache.move_to_end(pattern)
+                return cached
+
+        t_lo, t_hi = self.pattern_trip_offsets[pattern], self.pattern_trip_offsets[pattern + 1]
+        n_stops = self.pattern_stop_offsets[pattern + 1] - self.pattern_stop_offsets[pattern]
+        arr, dep = expand_pattern_times(self, t_lo, t_hi, n_stops)
+
+        with self._cache_lock:
+            self._pattern_cache[pattern] = (arr, dep)
+            if len(self._pattern_cache) > self.max_cached_patterns:
+                self._pattern_cache.popitem(last=False)
+        return arr, dep
+
+    def nbytes(self) -> int:
+        """编译后数组占用的内存（字节），不含缓存"""
+        return sum(getattr(self, name).nbytes for name in ARRAY_NAMES)
+
+    def save(self, npz_output_path: str, meta_output_path: str) -> None:
+        """将数组保存为 .npz，将 stop_id / trip_id 列表保存为 JSON"""
+        np.savez(npz_output_path, **{name: getattr(self, name) for name in ARRAY_NAMES})
+        with open(meta_output_path, 'w', encoding='utf-8') as f:
+            json.dump({'stop_ids': self.stop_ids, 'trip_ids': self.trip_ids}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, npz_file_path: str, meta_file_path: str) -> 'Timetable':
+        """加载 save() 保存的时刻表"""
+        data = np.load(npz_file_path)
+        with open(meta_file_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls({name: data[name] for name in ARRAY_NAMES}, meta['stop_ids'], meta['trip_ids'])
+
+
+def find_segments_with_min(tt: Timetable, start_stop: str, end_stop: str, min_dep_sec: int) -> List[dict]:
+    """
+    与 preprocess.find_segments_with_min 结果结构相同的查询，但按 pattern 扫描编译后的时刻表：
+    对每个同时经过两站的 pattern，只需二分查找第一趟满足出发时间的车。
+    """
+    segments = []
+    start = tt.stop_idx.get(start_stop)
+    end = tt.stop_idx.get(end_stop)
+    if start is None or end is None:
+        return segments
+
+    patterns, positions = tt.patterns_at_stop(start)
+    for pattern, idx in zip(patterns.tolist(), positions.tolist()):
+        stops = tt.pattern_stops_of(pattern)
+        later = np.flatnonzero(stops[idx + 1:] == end)
+        if len(later) == 0:
+            continue
+        j = idx + 1 + int(later[0])
+        arr, dep = tt.pattern_times(pattern)
+        first = int(np.searchsorted(dep[:, idx], min_dep_sec, side='left'))
+        trip_base = tt.pattern_trip_offsets[pattern]
+        for row in range(first, len(dep)):
+            dep_sec = int(dep[row, idx])
+            arr_sec = int(arr[row, j])
+            segments.append({
+                'trip_id': tt.trip_ids[trip_base + row],
+                'board_stop': start_stop,
+                'alight_stop': end_stop,
+                'departure_time': seconds_to_time(dep_sec),
+                'arrival_time': seconds_to_time(arr_sec),
+                'departure_sec': dep_sec,
+                'arrival_sec': arr_sec,
+                'stop_count': j - idx + 1,
+                'start_index': idx,
+                'end_index': j
+            })
+    return segments
+
+
+# 测试代码
+if __name__ == "__main__":
+    input_file = "raw_file/stop_times.txt"
+    npz_output = "timetable.npz"
+    meta_output = "timetable.json"
+
+    trips = read_stop_times(input_file)
+    tt = compile_timetable(trips)
+    print(f"行程数量: {tt.n_trips}, 站点数量: {tt.n_stops}, pattern 数量: {tt.n_patterns}, "
+          f"运行时间模板数量: {len(tt.profile_offsets) - 1}, 例外记录数量: {len(tt.exc_pos)}")
+    print(f"编译后数组大小: {tt.nbytes() / 1024 / 1024:.2f} MB")
+    tt.save(npz_output, meta_output)
+    print(f"时刻表已保存到 {npz_output} 和 {meta_output}")
+
+    segments = find_segments_with_min(tt, "de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst",
+                                      time_to_seconds("04:30:00"))
+    if segments:
+        print(min(segments, key=lambda x: x['departure_sec']))
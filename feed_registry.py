@@ -0,0 +1,185 @@
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from compile_timetable import ARRAY_NAMES, Timetable, load_transfers, time_to_seconds
+from raptor import Transfers
+
+# 合并时需要加上前面各 feed 总长度的 CSR 偏移数组
+OFFSET_ARRAYS = ('pattern_stop_offsets', 'pattern_trip_offsets', 'profile_offsets', 'exc_offsets')
+
+
+def _concat_offsets(parts: List[np.ndarray]) -> np.ndarray:
+    """拼接多个 CSR 偏移数组，后一段的偏移加上前面各段的总长度"""
+    merged = [parts[0][:1]]
+    base = 0
+    for offsets in parts:
+        merged.append(offsets[1:] + base)
+        base += int(offsets[-1])
+    return np.concatenate(merged)
+
+
+class FeedRegistry:
+    """
+    在一个进程中加载多个编译后的 feed（例如慕尼黑市区与周边区域），合并为一张可跨 feed 路由的时刻表。
+
+    - 所有 feed 共用一张全局站点表，stop_id 相同的站点合并为同一个站点，
+      因此在重叠站点可以直接换乘到另一个 feed 的线路上；
+    - stop_id / trip_id 字符串只保存一份（sys.intern），各 feed 的数组拼接为一套 Timetable 数组，
+      pattern / trip 的编号按 feed 依次排列，feed_trip_offsets 记录每个 feed 的 trip 范围；
+    - 合并后的时刻表直接引用注册表的 stop_ids / stop_idx / trip_ids / trip_idx，不另存一份；
+    - 不同 feed 中 trip_id 重复时，后加入的 trip_id 加上 "<feed 名称>:" 前缀，
+      前缀后仍重复时再加 ":2"、":3" 等后缀，直到唯一。
+    """
+
+    def __init__(self):
+        self.feed_names: List[str] = []
+        self.stop_ids: List[str] = []
+        self.stop_idx: Dict[str, int] = {}
+        # 各 feed 的局部站点编号 -> 全局站点编号
+        self.feed_stops: Dict[str, np.ndarray] = {}
+        self.trip_ids: List[str] = []
+        self.trip_idx: Dict[str, int] = {}
+        # 第 i 个 feed 的 trip 在合并时刻表中的编号为 [feed_trip_offsets[i], feed_trip_offsets[i + 1])
+        self.feed_trip_offsets: List[int] = [0]
+        self._feeds: List[Tuple[Timetable, Transfers]] = []
+        self._merged: Optional[Timetable] = None
+        self._transfers: Optional[Transfers] = None
+
+    def intern_stop(self, stop_id: str) -> int:
+        """返回站点的全局编号，新站点加入全局站点表"""
+        idx = self.stop_idx.get(stop_id)
+        if idx is None:
+            stop_id = sys.intern(stop_id)
+            idx = self.stop_idx[stop_id] = len(self.stop_ids)
+            self.stop_ids.append(stop_id)
+        return idx
+
+    def add_feed(self, name: str, tt: Timetable, transfers: Transfers) -> None:
+        """
+        加入一个已编译的 feed。
+
+        参数:
+            name (str): feed 名称
+            tt (Timetable): 该 feed 编译后的时刻表
+            transfers (Transfers): 该 feed 的换乘表（站点编号为 tt 中的局部编号）
+        """
+        if name in self.feed_stops:
+            raise ValueError(f"feed 已存在: {name}")
+        if self._merged is not None and not self._feeds:
+            raise ValueError("release_feeds() 之后不能再加入 feed")
+        if self._merged is not None:
+            # 已构建的合并时刻表引用着当前的列表与字典，换成新的副本再修改，保证它不受影响
+            self.stop_ids, self.stop_idx = list(self.stop_ids), dict(self.stop_idx)
+            self.trip_ids, self.trip_idx = list(self.trip_ids), dict(self.trip_idx)
+        self.feed_names.append(name)
+        self.feed_stops[name] = np.array([self.intern_stop(stop_id) for stop_id in tt.stop_ids], dtype=np.int64)
+        own = set(tt.trip_ids)
+        for trip_id in tt.trip_ids:
+            if trip_id in self.trip_idx:
+                # 改名后的 trip_id 既不能与已有的重复，也不能与本 feed 中尚未加入的 trip_id 重复
+                renamed = f"{name}:{trip_id}"
+                n = 1
+                while renamed in self.trip_idx or renamed in own:
+                    n += 1
+                    renamed = f"{name}:{trip_id}:{n}"
+                trip_id = renamed
+            trip_id = sys.intern(trip_id)
+            self.trip_idx[trip_id] = len(self.trip_ids)
+            self.trip_ids.append(trip_id)
+        self.feed_trip_offsets.append(len(self.trip_ids))
+        self._feeds.append((tt, transfers))
+        self._merged = None
+        self._transfers = None
+
+    def load_feed(self, name: str, directory: str) -> None:
+        """从目录加载 feed：timetable.npz、timetable.json 与 transfers.json（与 compile_timetable.py 的输出相同）"""
+        tt = Timetable.load(os.path.join(directory, "timetable.npz"), os.path.join(directory, "timetable.json"))
+        transfers = load_transfers(os.path.join(directory, "transfers.json"), tt.stop_idx)
+        self.add_feed(name, tt, transfers)
+        print(f"已加载 feed {name}: 站点 {tt.n_stops}, trip {tt.n_trips}, pattern {tt.n_patterns}")
+
+    @property
+    def timetable(self) -> Timetable:
+        """合并后的时刻表（首次访问时构建，加入新 feed 后重新构建）"""
+        if self._merged is None:
+            self._merged = self._merge()
+        return self._merged
+
+    @property
+    def transfers(self) -> Transfers:
+        """
+        合并后的换乘表：各 feed 的换乘映射到全局站点编号，同一对站点保留最短换乘时间。
+        """
+        if self._transfers is None:
+            best: Dict[Tuple[int, int], int] = {}
+            for name, (_, transfers) in zip(self.feed_names, self._feeds):
+                mapping = self.feed_stops[name]
+                for stop, edges in transfers.items():
+                    for to_stop, transfer_time in edges:
+                        key = (int(mapping[stop]), int(mapping[to_stop]))
+                        if transfer_time < best.get(key, transfer_time + 1):
+                            best[key] = transfer_time
+            self._transfers = {}
+            for (stop, to_stop), transfer_time in best.items():
+                self._transfers.setdefault(stop, []).append((to_stop, transfer_time))
+        return self._transfers
+
+    def _merge(self) -> Timetable:
+        if not self._feeds:
+            raise ValueError("没有加载任何 feed")
+        tts = [tt for tt, _ in self._feeds]
+        arrays: Dict[str, np.ndarray] = {}
+        for name in OFFSET_ARRAYS:
+            arrays[name] = _concat_offsets([getattr(tt, name) for tt in tts])
+
+        # 编号类数组加上前面各 feed 的数量，站点换成全局编号
+        pattern_base = np.cumsum([0] + [tt.n_patterns for tt in tts])
+        profile_base = np.cumsum([0] + [len(tt.profile_offsets) - 1 for tt in tts])
+        arrays['pattern_stops'] = np.concatenate([
+            self.feed_stops[name][tt.pattern_stops].astype(tt.pattern_stops.dtype)
+            for name, tt in zip(self.feed_names, tts)])
+        arrays['trip_pattern'] = np.concatenate([
+            (tt.trip_pattern + pattern_base[i]).astype(tt.trip_pattern.dtype) for i, tt in enumerate(tts)])
+        arrays['trip_profile'] = np.concatenate([
+            (tt.trip_profile + profile_base[i]).astype(tt.trip_profile.dtype) for i, tt in enumerate(tts)])
+        for name in ARRAY_NAMES:
+            if name not in arrays:
+                arrays[name] = np.concatenate([getattr(tt, name) for tt in tts])
+
+        return Timetable(arrays, self.stop_ids, self.trip_ids, stop_idx=self.stop_idx, trip_idx=self.trip_idx)
+
+    def release_feeds(self) -> None:
+        """构建合并时刻表后释放各 feed 自己的数组，只保留合并后的一份"""
+        _ = self.timetable, self.transfers
+        self._feeds = []
+
+    def feed_of_trip(self, trip: int) -> str:
+        """合并时刻表中的 trip 编号所属的 feed"""
+        return self.feed_names[int(np.searchsorted(self.feed_trip_offsets, trip, side='right')) - 1]
+
+    def nbytes(self) -> int:
+        """合并后时刻表数组占用的内存（字节）"""
+        return self.timetable.nbytes()
+
+
+# 测试代码
+if __name__ == "__main__":
+    from raptor import earliest_arrival
+
+    registry = FeedRegistry()
+    registry.load_feed("muenchen", "feeds/muenchen")
+    registry.load_feed("region", "feeds/region")
+    tt, transfers = registry.timetable, registry.transfers
+    registry.release_feeds()
+    print(f"合并后站点 {tt.n_stops}, trip {tt.n_trips}, pattern {tt.n_patterns}, "
+          f"数组大小: {registry.nbytes() / 1024 / 1024:.2f} MB")
+
+    journey = earliest_arrival(tt, transfers, "de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst",
+                               time_to_seconds("04:30:00"))
+    if journey:
+        for leg in journey['legs']:
+            print(registry.feed_of_trip(tt.trip_idx[leg['trip_id']]), leg['trip_id'],
+                  leg['departure_time'], leg['arrival_time'])
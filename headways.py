@@ -0,0 +1,157 @@
+import csv
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from compile_timetable import Timetable, expand_stop_times, seconds_to_time
+
+
+def route_from_trip_id(trip_id: str) -> str:
+    """没有 trips.txt 时从 trip_id 中取线路名，例如 1.T0.31-U6-G-013-1.4.R -> U6"""
+    parts = trip_id.split('-')
+    return parts[1] if len(parts) > 1 else trip_id
+
+
+def load_trip_routes(tt: Timetable, trips_file_path: Optional[str] = None) -> Tuple[np.ndarray, List[str]]:
+    """
+    为每个 trip 分配线路编号。
+
+    参数:
+        tt (Timetable): 编译后的时刻表
+        trips_file_path (Optional[str]): GTFS trips.txt 的路径，提供时使用其中的 route_id，
+            否则用 route_from_trip_id 从 trip_id 推断
+
+    返回:
+        Tuple[np.ndarray, List[str]]: (trip 编号 -> 线路编号, 线路名称列表)
+    """
+    routes: Dict[str, str] = {}
+    if trips_file_path is not None:
+        with open(trips_file_path, 'r', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                routes[row['trip_id']] = row['route_id']
+    names = [routes.get(trip_id) or route_from_trip_id(trip_id) for trip_id in tt.trip_ids]
+    route_ids, trip_route = np.unique(np.array(names), return_inverse=True)
+    return trip_route.astype(np.int32), route_ids.tolist()
+
+
+def departure_events(tt: Timetable) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    一次性还原全部出发事件（不含每个 trip 的终点站）。
+
+    返回:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (trip 编号, 站点编号, 出发时间秒)
+    """
+    trip, pos, stop, _, dep = expand_stop_times(tt)
+    lengths = np.diff(tt.pattern_stop_offsets)[tt.trip_pattern]
+    keep = pos < lengths[trip] - 1
+    return trip[keep], stop[keep], dep[keep]
+
+
+def frequency_report(tt: Timetable, trips_file_path: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+    """
+    计算全网的发车间隔与发车频率统计（按线路、站点分组的 NumPy 运算，一次遍历全部出发事件）。
+
+    返回:
+        Dict[str, pd.DataFrame]:
+            'stops': 每个 (线路, 站点) 的发车次数、首末班时间、最小/平均/最大发车间隔（秒）
+            'hourly': 每个 (线路, 站点, 小时) 的发车次数
+            'routes': 每条线路的 trip 数量与首末班发车时间
+    """
+    trip_route, route_ids = load_trip_routes(tt, trips_file_path)
+    trip, stop, dep = departure_events(tt)
+    route = trip_route[trip].astype(np.int64)
+
+    # 按 (线路, 站点, 出发时间) 排序后，相同 (线路, 站点) 的事件连续排列
+    key = route * tt.n_stops + stop
+    order = np.lexsort((dep, key))
+    key, dep = key[order], dep[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    ends = np.r_[starts[1:], len(key)]
+    counts = ends - starts
+
+    # 组内相邻出发时间之差即发车间隔；每组第一条事件没有间隔
+    gaps = np.diff(dep, prepend=dep[:1]).astype(np.float64)
+    gaps[starts] = np.nan
+    has_gap = counts > 1
+    gap_sum = np.add.reduceat(np.nan_to_num(gaps), starts)
+    gap_min = np.fmin.reduceat(gaps, starts)
+    gap_max = np.fmax.reduceat(gaps, starts)
+    group_key = key[starts]
+    group_route = group_key // tt.n_stops
+    group_stop = group_key % tt.n_stops
+
+    stops = pd.DataFrame({
+        'route_id': np.array(route_ids, dtype=object)[group_route],
+        'stop_id': np.array(tt.stop_ids, dtype=object)[group_stop],
+        'departures': counts,
+        'first_departure': [seconds_to_time(s) for s in dep[starts]],
+        'last_departure': [seconds_to_time(s) for s in dep[ends - 1]],
+        'min_headway_sec': np.where(has_gap, gap_min, np.nan),
+        'mean_headway_sec': np.where(has_gap, gap_sum / np.maximum(counts - 1, 1), np.nan),
+        'max_headway_sec': np.where(has_gap, gap_max, np.nan),
+    })
+
+    # 每小时发车次数（时间可能超过 24 小时，按 GTFS 的服务日小时计）
+    hour = dep // 3600
+    n_hours = int(hour.max()) + 1 if len(hour) else 1
+    hourly_key, hourly_count = np.unique(key * n_hours + hour, return_counts=True)
+    hourly_group = hourly_key // n_hours
+    hourly = pd.DataFrame({
+        'route_id': np.array(route_ids, dtype=object)[hourly_group // tt.n_stops],
+        'stop_id': np.array(tt.stop_ids, dtype=object)[hourly_group % tt.n_stops],
+        'hour': hourly_key % n_hours,
+        'trips': hourly_count,
+    })
+
+    # 线路级统计：按首站出发时间
+    route_trips = np.bincount(trip_route, minlength=len(route_ids))
+    first_start = np.full(len(route_ids), np.iinfo(np.int64).max)
+    last_start = np.full(len(route_ids), -1)
+    np.minimum.at(first_start, trip_route, tt.trip_start)
+    np.maximum.at(last_start, trip_route, tt.trip_start)
+    present = route_trips > 0
+    routes = pd.DataFrame({
+        'route_id': np.array(route_ids, dtype=object)[present],
+        'trips': route_trips[present],
+        'first_departure': [seconds_to_time(s) for s in first_start[present]],
+        'last_departure': [seconds_to_time(s) for s in last_start[present]],
+    })
+    return {'stops': stops, 'hourly': hourly, 'routes': routes}
+
+
+def write_report(report: Dict[str, pd.DataFrame], output_prefix: str, file_format: str = 'csv') -> List[str]:
+    """
+    将 frequency_report 的结果写入文件，每张表一个文件：<output_prefix>_<表名>.csv / .parquet。
+
+    Parquet 需要安装 pyarrow 或 fastparquet。
+    """
+    if file_format not in ('csv', 'parquet'):
+        raise ValueError(f"不支持的输出格式: {file_format}")
+    paths = []
+    for name, df in report.items():
+        path = f"{output_prefix}_{name}.{file_format}"
+        if file_format == 'parquet':
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+# 测试代码
+if __name__ == "__main__":
+    import time
+
+    start = time.time()
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    report = frequency_report(tt, "raw_file/trips.txt")
+    print(f"统计完成，用时 {time.time() - start:.1f} 秒")
+
+    # 与 test.py 相同的分析：U6 的运营小时
+    u6 = report['hourly'][report['hourly']['route_id'].str.contains('U6')]
+    print(sorted(u6['hour'].unique()))
+    print(report['stops'].head())
+
+    for path in write_report(report, "frequency"):
+        print(f"已保存 {path}")
@@ -0,0 +1,239 @@
+import csv
+import math
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, load_transfers, time_to_seconds
+from raptor import INF, RaptorSearch, Transfers
+
+# 经纬度与米的换算（与 walk.py 中的近似相同）
+METERS_PER_DEG_LAT = 110540.0
+METERS_PER_DEG_LON = 111320.0
+
+
+def load_stop_coordinates(file_path: str, tt: Timetable) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读取 stops.txt 中的坐标，按时刻表的站点顺序排列。
+
+    返回:
+        Tuple[np.ndarray, np.ndarray]: (纬度, 经度)，stops.txt 中缺失的站点为 nan
+    """
+    lat = np.full(tt.n_stops, np.nan)
+    lon = np.full(tt.n_stops, np.nan)
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            idx = tt.stop_idx.get(row['stop_id'])
+            if idx is not None and row['stop_lat'] and row['stop_lon']:
+                lat[idx] = float(row['stop_lat'])
+                lon[idx] = float(row['stop_lon'])
+    return lat, lon
+
+
+def _to_meters(lat: np.ndarray, lon: np.ndarray, lat0: float, lon0: float) -> Tuple[np.ndarray, np.ndarray]:
+    """以 (lat0, lon0) 为原点的局部平面坐标（米）"""
+    scale = math.cos(math.radians(lat0)) * METERS_PER_DEG_LON
+    return (lon - lon0) * scale, (lat - lat0) * METERS_PER_DEG_LAT
+
+
+def travel_times(tt: Timetable, transfers: Transfers, stop_lat: np.ndarray, stop_lon: np.ndarray,
+                 lat: float, lon: float, dep_sec: int, max_rounds: int = 5,
+                 walk_speed: float = 1.2, max_access_sec: int = 600) -> np.ndarray:
+    """
+    从某个位置出发到所有站点的最早到达时间（相对出发时间的秒数，不可达为 INF）。
+
+    先步行（直线距离）到 max_access_sec 内可达的站点，以各站的步行到达时间作为第 0 轮标签，
+    再进行一次 one-to-all RAPTOR 搜索。
+    """
+    search = RaptorSearch(tt, transfers, max_rounds)
+    x, y = _to_meters(stop_lat, stop_lon, lat, lon)
+    with np.errstate(invalid='ignore'):
+        access = np.hypot(x, y) / walk_speed
+    seeds = {origin: dep_sec + int(access[origin])
+             for origin in np.flatnonzero(access <= max_access_sec).tolist()}
+    search.run_many(seeds)
+    # 乘车到达，或经换乘步行（含起点站的步行接驳）到达
+    reached = np.minimum(search.arrival.min(axis=0), search.ready.min(axis=0))
+    return np.where(reached < INF, reached - dep_sec, INF)
+
+
+def rasterize(stop_x: np.ndarray, stop_y: np.ndarray, stop_times: np.ndarray, max_time: int,
+              cell_size: float, walk_speed: float, max_walk_sec: int) -> Tuple[np.ndarray, float, float]:
+    """
+    将“到达站点的时间 + 从站点步行的时间”栅格化，每个格子取所有站点中的最小值。
+
+    返回:
+        Tuple[np.ndarray, float, float]: (时间栅格 [行, 列]，不可达为 inf；栅格左下角的 x, y)
+    """
+    remaining = np.minimum(max_time - stop_times, max_walk_sec)
+    keep = (stop_times <= max_time) & np.isfinite(stop_x) & np.isfinite(stop_y)
+    stop_x, stop_y = stop_x[keep], stop_y[keep]
+    stop_times, radius = stop_times[keep], remaining[keep] * walk_speed
+    if len(stop_x) == 0:
+        return np.full((0, 0), np.inf), 0.0, 0.0
+
+    x0 = math.floor((stop_x - radius).min() / cell_size) * cell_size
+    y0 = math.floor((stop_y - radius).min() / cell_size) * cell_size
+    cols = int(math.ceil(((stop_x + radius).max() - x0) / cell_size)) + 1
+    rows = int(math.ceil(((stop_y + radius).max() - y0) / cell_size)) + 1
+    grid = np.full((rows, cols), np.inf)
+    for sx, sy, t, r in zip(stop_x.tolist(), stop_y.tolist(), stop_times.tolist(), radius.tolist()):
+        c_lo, c_hi = max(int((sx - r - x0) // cell_size), 0), min(int((sx + r - x0) // cell_size) + 1, cols)
+        r_lo, r_hi = max(int((sy - r - y0) // cell_size), 0), min(int((sy + r - y0) // cell_size) + 1, rows)
+        # 以格子中心到站点的距离计算步行时间
+        cx = x0 + (np.arange(c_lo, c_hi) + 0.5) * cell_size - sx
+        cy = y0 + (np.arange(r_lo, r_hi) + 0.5) * cell_size - sy
+        walk = np.hypot(cy[:, None], cx[None, :]) / walk_speed
+        cell_times = np.where(walk <= r / walk_speed, t + walk, np.inf)
+        np.minimum(grid[r_lo:r_hi, c_lo:c_hi], cell_times, out=grid[r_lo:r_hi, c_lo:c_hi])
+    return grid, x0, y0
+
+
+def _signed_area(ring: List[Tuple[int, int]]) -> float:
+    return 0.5 * sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:]))
+
+
+def _contains(ring: List[Tuple[int, int]], px: float, py: float) -> bool:
+    """射线法判断点是否在环内"""
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > py) != (y2 > py) and px < x1 + (py - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def _drop_collinear(ring: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """去掉环上同方向连续边之间的格点，返回首尾相同的闭合环"""
+    n = len(ring)
+    kept = []
+    for i in range(n):
+        (px, py), (x, y), (nx, ny) = ring[i - 1], ring[i], ring[(i + 1) % n]
+        if (x - px, y - py) != (0, 0) and (np.sign(x - px), np.sign(y - py)) == (np.sign(nx - x), np.sign(ny - y)):
+            continue
+        kept.append(ring[i])
+    return kept + kept[:1]
+
+
+def mask_polygons(mask: np.ndarray) -> List[List[List[Tuple[int, int]]]]:
+    """
+    将二值栅格的边界追踪为多边形（坐标为格点 (列, 行)，行向上增长）。
+
+    外环逆时针、内环（洞）顺时针，符合 GeoJSON 的环方向约定。对角相接的格子视为不连通，
+    同一连通区域绕回对角格点时，环会在该格点处自身相接。
+
+    返回:
+        List[List[List[Tuple[int, int]]]]: 多边形列表，每个多边形为 [外环, 洞...]，环首尾相同
+    """
+    padded = np.pad(mask, 1)
+    inner = padded[1:-1, 1:-1]
+    # 每个边界边按“区域在左侧”的方向记录: 起点 -> 方向
+    edges: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+    sides = (
+        (padded[:-2, 1:-1], (0, 0), (1, 0)),    # 下边: 下方为空，向 +x
+        (padded[1:-1, 2:], (1, 0), (0, 1)),     # 右边: 右侧为空，向 +y
+        (padded[2:, 1:-1], (1, 1), (-1, 0)),    # 上边: 上方为空，向 -x
+        (padded[1:-1, :-2], (0, 1), (0, -1)),   # 左边: 左侧为空，向 -y
+    )
+    for neighbour, (ox, oy), direction in sides:
+        rows, cols = np.nonzero(inner & ~neighbour)
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            edges.setdefault((c + ox, r + oy), []).append(direction)
+
+    rings = []
+    # 从只有一条出边的格点开始追踪（对角相接的格点有两条出边）
+    for start in list(edges):
+        if len(edges.get(start, ())) != 1:
+            continue
+        point, direction = start, edges[start][0]
+        ring = [start]
+        while True:
+            outgoing = edges[point]
+            if len(outgoing) > 1:
+                # 对角相接处优先左转，使每个环只包围一组连通的格子
+                dx, dy = direction
+                direction = next(d for d in ((-dy, dx), (dx, dy), (dy, -dx)) if d in outgoing)
+            else:
+                direction = outgoing[0]
+            outgoing.remove(direction)
+            if not outgoing:
+                del edges[point]
+            point = (point[0] + direction[0], point[1] + direction[1])
+            if point == start:
+                break
+            ring.append(point)
+        rings.append(_drop_collinear(ring))
+
+    outers = [ring for ring in rings if _signed_area(ring) > 0]
+    polygons = [[ring] for ring in sorted(outers, key=_signed_area)]
+    for hole in (ring for ring in rings if _signed_area(ring) < 0):
+        # 洞的第一条边左侧的格子属于包含该洞的多边形
+        (x1, y1), (x2, y2) = hole[0], hole[1]
+        length = max(abs(x2 - x1), abs(y2 - y1))
+        dx, dy = (x2 - x1) / length, (y2 - y1) / length
+        px, py = x1 + 0.5 * dx - 0.5 * dy, y1 + 0.5 * dy + 0.5 * dx
+        for polygon in polygons:
+            if _contains(polygon[0], px, py):
+                polygon.append(hole)
+                break
+    return polygons
+
+
+def isochrone_geojson(tt: Timetable, transfers: Transfers, stop_lat: np.ndarray, stop_lon: np.ndarray,
+                      lat: float, lon: float, dep_sec: int, thresholds_min: Sequence[int] = (10, 20, 30),
+                      cell_size: float = 100.0, walk_speed: float = 1.2, max_walk_sec: int = 900,
+                      max_rounds: int = 5) -> dict:
+    """
+    计算等时圈，返回 GeoJSON FeatureCollection（每个时间阈值一个 MultiPolygon，阈值从大到小排列，
+    便于按顺序叠加绘制）。
+
+    参数:
+        lat, lon (float): 出发位置
+        dep_sec (int): 出发时间（秒）
+        thresholds_min (Sequence[int]): 时间阈值（分钟）
+        cell_size (float): 栅格边长（米）
+        walk_speed (float): 步行速度（米/秒）
+        max_walk_sec (int): 起点与下车后的最长步行时间（秒）
+    """
+    thresholds = sorted({int(t) * 60 for t in thresholds_min})
+    times = travel_times(tt, transfers, stop_lat, stop_lon, lat, lon, dep_sec, max_rounds,
+                         walk_speed, max_walk_sec).astype(np.float64)
+    times[times >= INF] = np.inf
+    stop_x, stop_y = _to_meters(stop_lat, stop_lon, lat, lon)
+    # 起点本身也是可以步行出发的位置
+    stop_x = np.append(stop_x, 0.0)
+    stop_y = np.append(stop_y, 0.0)
+    times = np.append(times, 0.0)
+    grid, x0, y0 = rasterize(stop_x, stop_y, times, thresholds[-1], cell_size, walk_speed, max_walk_sec)
+
+    scale = math.cos(math.radians(lat)) * METERS_PER_DEG_LON
+    features = []
+    for threshold in reversed(thresholds):
+        polygons = mask_polygons(grid <= threshold)
+        coordinates = [
+            [[[round(lon + (x0 + c * cell_size) / scale, 6), round(lat + (y0 + r * cell_size) / METERS_PER_DEG_LAT, 6)]
+              for c, r in ring] for ring in polygon]
+            for polygon in polygons
+        ]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "MultiPolygon", "coordinates": coordinates},
+            "properties": {"minutes": threshold // 60}
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+# 测试代码
+if __name__ == "__main__":
+    import json
+    import time
+
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    transfers = load_transfers("transfers.json", tt.stop_idx)
+    stop_lat, stop_lon = load_stop_coordinates("stops.txt", tt)
+
+    start = time.time()
+    # 玛利亚广场，08:00 出发
+    result = isochrone_geojson(tt, transfers, stop_lat, stop_lon, 48.13725, 11.57542, time_to_seconds("08:00:00"))
+    print(f"等时圈计算完成，用时 {time.time() - start:.2f} 秒")
+    with open("isochrone.geojson", 'w', encoding='utf-8') as f:
+        json.dump(result, f)
@@ -0,0 +1,233 @@
+import heapq
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, expand_stop_times, load_transfers, time_to_seconds
+from process_stop_times_adjacency import load_numpy_matrix
+from raptor import Transfers, earliest_arrival
+
+
+def build_min_time_graph(adjacency: np.ndarray, transfers_json_path: Optional[str],
+                         stop_to_index: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    将最小单跳行驶时间矩阵（以及 transfers.json 中的换乘时间）转为 CSR 格式的有向图。
+
+    参数:
+        adjacency (np.ndarray): preprocess_stop_times_to_numpy_matrix 生成的邻接矩阵，np.inf 表示无连接
+        transfers_json_path (Optional[str]): transfers.json 文件的路径，换乘也是行程的一部分，需要计入下界图
+        stop_to_index (Dict[str, int]): 站点 ID 到矩阵索引的映射
+
+    返回:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (offsets, targets, weights)
+    """
+    n = adjacency.shape[0]
+    src, dst = np.nonzero(np.isfinite(adjacency))
+    # 数据中偶尔会出现负的行驶时间，下界不能为负
+    weights = np.maximum(adjacency[src, dst], 0.0)
+
+    if transfers_json_path is not None:
+        with open(transfers_json_path, 'r', encoding='utf-8') as f:
+            transfers = json.load(f)
+        extra_src, extra_dst, extra_w = [], [], []
+        for key, transfer_time in transfers.items():
+            parts = key.split(" to ")
+            if len(parts) != 2 or parts[0] == parts[1]:
+                continue
+            a = stop_to_index.get(parts[0])
+            b = stop_to_index.get(parts[1])
+            if a is None or b is None:
+                continue
+            extra_src.append(a)
+            extra_dst.append(b)
+            extra_w.append(max(float(transfer_time), 0.0))
+        src = np.concatenate([src, np.array(extra_src, dtype=src.dtype)])
+        dst = np.concatenate([dst, np.array(extra_dst, dtype=dst.dtype)])
+        weights = np.concatenate([weights, np.array(extra_w, dtype=weights.dtype)])
+
+    order = np.argsort(src, kind='stable')
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+    return offsets, dst[order].astype(np.int32), weights[order]
+
+
+def timetable_min_time_graph(tt: Timetable, transfers: Transfers) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    由编译后的时刻表直接构造最小行驶时间图（CSR 格式，结构同 build_min_time_graph）：
+    pattern 中相邻两站之间取所有 trip 的最短行驶时间，再加上换乘边。
+    """
+    trip, pos, _, arr, dep = expand_stop_times(tt)
+    # 同一 trip 的相邻两条记录构成一段行驶，边按 pattern 停站序列中的位置编号
+    same_trip = trip[1:] == trip[:-1]
+    edge = (tt.pattern_stop_offsets[tt.trip_pattern[trip[:-1]]] + pos[:-1])[same_trip]
+    min_time = np.full(len(tt.pattern_stops), np.inf)
+    np.minimum.at(min_time, edge, (arr[1:] - dep[:-1])[same_trip])
+    # 每个 pattern 的最后一站没有出边
+    has_edge = np.isfinite(min_time)
+    src = tt.pattern_stops[has_edge].astype(np.int64)
+    dst = tt.pattern_stops[1:][has_edge[:-1]].astype(np.int64)
+    weights = np.maximum(min_time[has_edge], 0.0)
+
+    extra = [(stop, to_stop, transfer_time) for stop, edges in transfers.items()
+             for to_stop, transfer_time in edges if to_stop != stop]
+    if extra:
+        extra_arr = np.array(extra, dtype=np.float64)
+        src = np.concatenate([src, extra_arr[:, 0].astype(np.int64)])
+        dst = np.concatenate([dst, extra_arr[:, 1].astype(np.int64)])
+        weights = np.concatenate([weights, np.maximum(extra_arr[:, 2], 0.0)])
+
+    order = np.argsort(src, kind='stable')
+    offsets = np.zeros(tt.n_stops + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=tt.n_stops), out=offsets[1:])
+    return offsets, dst[order].astype(np.int32), weights[order]
+
+
+def reverse_graph(offsets: np.ndarray, targets: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """将 CSR 图的所有边反向"""
+    n = len(offsets) - 1
+    sources = np.repeat(np.arange(n, dtype=np.int32), np.diff(offsets))
+    order = np.argsort(targets, kind='stable')
+    rev_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(targets, minlength=n), out=rev_offsets[1:])
+    return rev_offsets, sources[order], weights[order]
+
+
+def dijkstra(offsets: np.ndarray, targets: np.ndarray, weights: np.ndarray, source: int) -> np.ndarray:
+    """单源最短路，返回到各节点的距离（不可达为 np.inf）"""
+    dist = np.full(len(offsets) - 1, np.inf)
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    targets_list = targets.tolist()
+    weights_list = weights.tolist()
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for e in range(offsets[u], offsets[u + 1]):
+            v = targets_list[e]
+            nd = d + weights_list[e]
+            if nd < dist[v]:
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return dist
+
+
+def select_landmarks(offsets: np.ndarray, targets: np.ndarray, weights: np.ndarray,
+                     count: int, seed: int = 0) -> List[int]:
+    """最远点法选择地标：每次选择距离已选地标最远（且可达）的站点"""
+    n = len(offsets) - 1
+    degree = np.diff(offsets)
+    candidates = np.flatnonzero(degree > 0)
+    if len(candidates) == 0:
+        return []
+    rng = np.random.default_rng(seed)
+    landmarks = [int(rng.choice(candidates))]
+    closest = dijkstra(offsets, targets, weights, landmarks[0])
+    while len(landmarks) < min(count, n):
+        score = np.where(np.isfinite(closest), closest, -1.0)
+        score[landmarks] = -1.0
+        nxt = int(np.argmax(score))
+        if score[nxt] <= 0:
+            break
+        landmarks.append(nxt)
+        closest = np.minimum(closest, dijkstra(offsets, targets, weights, nxt))
+    return landmarks
+
+
+def preprocess_landmarks(npz_file_path: str, mapping_file_path: str, transfers_json_path: Optional[str],
+                         output_path: str, landmark_count: int = 16) -> None:
+    """
+    根据最小行驶时间邻接矩阵预计算 ALT 地标距离表。
+
+    参数:
+        npz_file_path (str): stop_times_adjacency.npz 文件的路径
+        mapping_file_path (str): stop_mapping.json 文件的路径
+        transfers_json_path (Optional[str]): transfers.json 文件的路径
+        output_path (str): 输出 .npz 文件路径
+        landmark_count (int): 地标数量
+    """
+    adjacency, stop_to_index = load_numpy_matrix(npz_file_path, mapping_file_path)
+    graph = build_min_time_graph(adjacency, transfers_json_path, stop_to_index)
+    rev = reverse_graph(*graph)
+    landmarks = select_landmarks(*graph, landmark_count)
+    # from_landmark[l, v] = d(l, v)，to_landmark[l, v] = d(v, l)
+    from_landmark = np.array([dijkstra(*graph, l) for l in landmarks], dtype=np.float32)
+    to_landmark = np.array([dijkstra(*rev, l) for l in landmarks], dtype=np.float32)
+    stop_ids = sorted(stop_to_index, key=stop_to_index.get)
+    np.savez(output_path, landmarks=np.array(landmarks, dtype=np.int32),
+             from_landmark=from_landmark, to_landmark=to_landmark, stop_ids=np.array(stop_ids))
+    print(f"已选择 {len(landmarks)} 个地标，距离表已保存到 {output_path}")
+
+
+class LandmarkBounds:
+    """由 ALT 地标距离表计算任意站点到终点的行程时间下界"""
+
+    def __init__(self, from_landmark: np.ndarray, to_landmark: np.ndarray, stop_ids: List[str]):
+        self.from_landmark = from_landmark
+        self.to_landmark = to_landmark
+        self.stop_ids = list(stop_ids)
+        self.stop_idx = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+
+    @classmethod
+    def load(cls, npz_file_path: str, tt: Optional[Timetable] = None) -> 'LandmarkBounds':
+        """加载预计算结果；给定时刻表时按时刻表的站点顺序重排（缺失站点的下界为 0）"""
+        with np.load(npz_file_path) as data:
+            from_landmark = data['from_landmark']
+            to_landmark = data['to_landmark']
+            stop_ids = data['stop_ids'].tolist()
+        if tt is None:
+            return cls(from_landmark, to_landmark, stop_ids)
+        index = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+        cols = np.array([index.get(stop_id, -1) for stop_id in tt.stop_ids], dtype=np.int64)
+        missing = cols < 0
+        # 缺失站点的距离取 nan，计算下界时会被当作没有信息
+        padded_from = np.concatenate([from_landmark, np.full((len(from_landmark), 1), np.nan, np.float32)], axis=1)
+        padded_to = np.concatenate([to_landmark, np.full((len(to_landmark), 1), np.nan, np.float32)], axis=1)
+        cols[missing] = from_landmark.shape[1]
+        return cls(padded_from[:, cols], padded_to[:, cols], tt.stop_ids)
+
+    def lower_bounds_to(self, target: int) -> np.ndarray:
+        """
+        所有站点到 target 的行程时间下界（秒）。
+
+        由三角不等式: d(v, t) >= d(l, t) - d(l, v) 以及 d(v, t) >= d(v, l) - d(t, l)，对所有地标取最大值。
+        """
+        if len(self.from_landmark) == 0:
+            return np.zeros(len(self.stop_ids))
+        with np.errstate(invalid='ignore'):
+            forward = self.from_landmark[:, target][:, None] - self.from_landmark
+            backward = self.to_landmark - self.to_landmark[:, target][:, None]
+            bounds = np.fmax(forward, backward)
+        # inf - inf 或缺失站点得到 nan，表示该地标没有提供信息
+        bounds = np.where(np.isnan(bounds), 0.0, bounds).max(axis=0)
+        bounds = np.maximum(bounds, 0.0)
+        bounds[target] = 0.0
+        return bounds
+
+
+def goal_directed_earliest_arrival(tt: Timetable, transfers: Transfers, bounds: LandmarkBounds,
+                                   start_stop: str, end_stop: str, current_time_sec: int,
+                                   max_rounds: int = 5) -> Optional[dict]:
+    """使用地标下界剪枝的最早到达查询：到达时间加下界不可能优于当前最优解的标签直接跳过"""
+    target = tt.stop_idx.get(end_stop)
+    if target is None:
+        return None
+    return earliest_arrival(tt, transfers, start_stop, end_stop, current_time_sec, max_rounds,
+                            lower_bounds=bounds.lower_bounds_to(target))
+
+
+# 测试代码
+if __name__ == "__main__":
+    npz_output = "stop_times_adjacency.npz"
+    mapping_output = "stop_mapping.json"
+    transfers_file = "transfers.json"
+    landmarks_output = "landmarks.npz"
+
+    preprocess_landmarks(npz_output, mapping_output, transfers_file, landmarks_output)
+
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    bounds = LandmarkBounds.load(landmarks_output, tt)
+    transfers = load_transfers(transfers_file, tt.stop_idx)
+    print(goal_directed_earliest_arrival(tt, transfers, bounds, "de:09162:40:51:51-Hst",
+                                         "de:09162:1140:51:51-Hst", time_to_seconds("04:30:00")))
@@ -0,0 +1,209 @@
+import asyncio
+import os
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from neo4j import AsyncGraphDatabase, GraphDatabase
+
+# Neo4j连接配置（可通过环境变量覆盖）
+NEO4J_CONFIG = {
+    "uri": os.environ.get("NEO4J_URI", "neo4j://localhost:7687"),
+    "user": os.environ.get("NEO4J_USER", "neo4j"),
+    "password": os.environ.get("NEO4J_PASSWORD", "password"),  # 请替换为您的密码
+    "database": os.environ.get("NEO4J_DATABASE") or None,
+    # 连接池大小与获取连接的超时时间（秒）
+    "max_connection_pool_size": int(os.environ.get("NEO4J_POOL_SIZE", "50")),
+    "connection_acquisition_timeout": float(os.environ.get("NEO4J_ACQUISITION_TIMEOUT", "60")),
+    # 每条 UNWIND 查询包含的起终点对数量
+    "batch_size": int(os.environ.get("NEO4J_BATCH_SIZE", "500")),
+}
+
+# (起点 stop_id, 终点 stop_id, 出发时间 HH:MM:SS)
+PathQuery = Tuple[str, str, str]
+
+# 批量路径查询：一次请求处理多个起终点对，时间以秒存储（与 test6.py 导入的数据一致）
+BATCH_PATH_QUERY = """
+UNWIND $queries AS q
+CALL {
+    WITH q
+    MATCH path = (start:Stop {stop_id: q.start_stop})-[:BUS|TRANSFER*]->(end:Stop {stop_id: q.end_stop})
+    WITH q, path, relationships(path) AS rels
+    UNWIND rels AS rel
+    WITH q, path, rels,
+         COLLECT(CASE WHEN type(rel) = 'BUS' THEN rel.departure_time ELSE null END) AS departures,
+         COLLECT(CASE WHEN type(rel) = 'BUS' THEN rel.arrival_time ELSE null END) AS arrivals,
+         COLLECT(CASE WHEN type(rel) = 'BUS' THEN rel.trip_id ELSE null END) AS trip_ids,
+         COLLECT(CASE WHEN type(rel) = 'TRANSFER' THEN rel.transfer_time ELSE null END) AS transfers
+    WHERE ALL(i IN RANGE(0, SIZE(departures)-1) WHERE
+              (departures[i] IS NOT NULL AND departures[i] >= q.start_seconds) AND
+              (i = 0 OR arrivals[i-1] + COALESCE(transfers[i-1], 0) <= departures[i]))
+    RETURN path, trip_ids, departures, arrivals, transfers
+    ORDER BY REDUCE(total_time = 0, r IN rels |
+                    total_time + CASE WHEN type(r) = 'BUS' THEN r.travel_time
+                                      WHEN type(r) = 'TRANSFER' THEN r.transfer_time
+                                      ELSE 0 END) ASC
+    LIMIT 1
+}
+RETURN q.id AS id, [n IN nodes(path) | n.stop_id] AS stops,
+       trip_ids, departures, arrivals, transfers
+"""
+
+_drivers: Dict[tuple, object] = {}
+_async_drivers: Dict[tuple, object] = {}
+
+
+def time_to_seconds(time_str: str) -> int:
+    """将时间字符串转换为秒"""
+    h, m, s = map(int, time_str.split(":"))
+    return h * 3600 + m * 60 + s
+
+
+def _driver_key(config: dict) -> tuple:
+    """驱动缓存键：包含影响驱动与会话的全部配置，凭据不同的配置不会拿到旧驱动"""
+    return (config["uri"], config["user"], config["password"], config.get("database"),
+            config["max_connection_pool_size"], config["connection_acquisition_timeout"])
+
+
+def get_driver(config: Optional[dict] = None):
+    """返回共享的同步驱动（首次调用时创建），驱动内部维护连接池"""
+    config = config or NEO4J_CONFIG
+    key = _driver_key(config)
+    if key not in _drivers:
+        _drivers[key] = GraphDatabase.driver(
+            config["uri"], auth=(config["user"], config["password"]),
+            max_connection_pool_size=config["max_connection_pool_size"],
+            connection_acquisition_timeout=config["connection_acquisition_timeout"])
+    return _drivers[key]
+
+
+def get_async_driver(config: Optional[dict] = None):
+    """返回共享的异步驱动（首次调用时创建）"""
+    config = config or NEO4J_CONFIG
+    key = _driver_key(config)
+    if key not in _async_drivers:
+        _async_drivers[key] = AsyncGraphDatabase.driver(
+            config["uri"], auth=(config["user"], config["password"]),
+            max_connection_pool_size=config["max_connection_pool_size"],
+            connection_acquisition_timeout=config["connection_acquisition_timeout"])
+    return _async_drivers[key]
+
+
+def close_drivers() -> None:
+    """关闭所有同步驱动（异步驱动请使用 close_async_drivers）"""
+    for driver in _drivers.values():
+        driver.close()
+    _drivers.clear()
+
+
+async def close_async_drivers() -> None:
+    for driver in _async_drivers.values():
+        await driver.close()
+    _async_drivers.clear()
+
+
+def _batches(queries: Iterable[PathQuery], batch_size: int) -> Iterator[List[dict]]:
+    """将起终点对转为查询参数并分批，id 为在输入中的序号"""
+    batch = []
+    for i, (start_stop, end_stop, start_time) in enumerate(queries):
+        batch.append({"id": i, "start_stop": start_stop, "end_stop": end_stop,
+                      "start_seconds": time_to_seconds(start_time)})
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _record_to_result(record) -> dict:
+    return {
+        "id": record["id"],
+        "stops": record["stops"],
+        "trip_ids": record["trip_ids"],
+        "departures": record["departures"],
+        "arrivals": record["arrivals"],
+        "transfers": record["transfers"],
+    }
+
+
+def find_paths_batch(queries: Iterable[PathQuery], config: Optional[dict] = None) -> Iterator[dict]:
+    """
+    批量查询路径：每批起终点对通过一条 UNWIND 查询发送，结果逐条流式返回。
+
+    参数:
+        queries (Iterable[PathQuery]): (起点, 终点, 出发时间) 序列
+        config (Optional[dict]): 连接配置，默认使用 NEO4J_CONFIG
+
+    返回:
+        Iterator[dict]: 找到路径的查询结果，id 为该查询在输入中的序号；未找到路径的查询不返回记录
+    """
+    config = config or NEO4J_CONFIG
+    driver = get_driver(config)
+    # 整个批量任务共用一个会话，避免每个查询都建立会话
+    with driver.session(database=config["database"]) as session:
+        for batch in _batches(queries, config["batch_size"]):
+            result = session.run(BATCH_PATH_QUERY, queries=batch)
+            for record in result:
+                yield _record_to_result(record)
+
+
+async def find_paths_batch_async(queries: Iterable[PathQuery], config: Optional[dict] = None,
+                                 concurrency: int = 4) -> AsyncIterator[dict]:
+    """
+    find_paths_batch 的异步版本：最多 concurrency 个批次同时在连接池中执行，结果按完成顺序返回。
+    """
+    config = config or NEO4J_CONFIG
+    driver = get_async_driver(config)
+    output: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+    done = object()
+
+    async def run_batch(batch: List[dict]) -> None:
+        async with semaphore:
+            try:
+                async with driver.session(database=config["database"]) as session:
+                    result = await session.run(BATCH_PATH_QUERY, queries=batch)
+                    async for record in result:
+                        await output.put(_record_to_result(record))
+            except Exception as e:
+                await output.put(e)
+
+    async def run_all() -> None:
+        await asyncio.gather(*(run_batch(batch) for batch in _batches(queries, config["batch_size"])))
+        await output.put(done)
+
+    task = asyncio.ensure_future(run_all())
+    try:
+        while True:
+            item = await output.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def find_path(start_stop: str, end_stop: str, start_time_str: str, config: Optional[dict] = None) -> Optional[dict]:
+    """查询单个起终点对，使用共享驱动的连接池；未找到路径时返回 None"""
+    for result in find_paths_batch([(start_stop, end_stop, start_time_str)], config):
+        return result
+    return None
+
+
+# 测试代码
+if __name__ == "__main__":
+    od_pairs = [
+        ("de:09162:40:51:51-Hst", "de:09162:200:51:52-Hst", "04:33:40"),
+        ("de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst", "08:00:00"),
+    ]
+    for path_result in find_paths_batch(od_pairs):
+        print(od_pairs[path_result["id"]], path_result["stops"])
+
+    async def main():
+        async for path_result in find_paths_batch_async(od_pairs):
+            print(od_pairs[path_result["id"]], path_result["trip_ids"])
+        await close_async_drivers()
+
+    asyncio.run(main())
+    close_drivers()
@@ -1,5 +1,6 @@
 import pandas as pd
 import json
+from bisect import bisect_right
 
 
 # 将时间字符串转换为秒数，便于比较
@@ -146,6 +147,103 @@ def find_transfer_trips(start_stop, end_stop, current_time):
     return None
 
 
+# ----------------------------
+# 到达时间索引：与 stop_index 记录相同，按 arrival_sec 升序排列，用于反向（按到达时间）查询
+# ----------------------------
+arrival_index = {stop: sorted(entries, key=lambda x: x[3]) for stop, entries in stop_index.items()}
+arrival_keys = {stop: [entry[3] for entry in entries] for stop, entries in arrival_index.items()}
+
+
+def find_segments_with_max(start_stop, end_stop, max_arr_sec):
+    segments = []
+    if end_stop not in arrival_index:
+        return segments
+
+    # 二分查找到达时间不晚于 max_arr_sec 的记录
+    count = bisect_right(arrival_keys[end_stop], max_arr_sec)
+    for (trip_id, idx, _, arr_sec) in arrival_index[end_stop][:count]:
+        trip_stops = trips[trip_id]
+        # 从下车站点前的记录中反向查找上车站
+        for j in range(idx - 1, -1, -1):
+            if trip_stops[j]['stop_id'] == start_stop:
+                stop_count = idx - j + 1  # 包括上车和下车站
+                segments.append({
+                    'trip_id': trip_id,
+                    'board_stop': start_stop,
+                    'alight_stop': end_stop,
+                    'departure_time': trip_stops[j]['departure_time'],
+                    'arrival_time': trip_stops[idx]['arrival_time'],
+                    'departure_sec': trip_stops[j]['departure_sec'],
+                    'arrival_sec': arr_sec,
+                    'stop_count': stop_count,
+                    'start_index': j,
+                    'end_index': idx
+                })
+                break  # 每趟车取最晚符合的上车方案
+    return segments
+
+
+# ----------------------------
+# 按时到达的直达方案：返回 arrive_by 之前到达、出发最晚的直达车段
+# ----------------------------
+def find_direct_trip_arrive_by(start_stop, end_stop, arrive_by):
+    arrive_by_sec = time_to_seconds(arrive_by)
+    segments = find_segments_with_max(start_stop, end_stop, arrive_by_sec)
+    if segments:
+        best_direct = max(segments, key=lambda x: x['departure_sec'])
+        return best_direct
+    return None
+
+
+# ----------------------------
+# 按时到达的换乘方案：支持一次换乘，返回出发最晚的换乘方案（结果结构与 find_transfer_trips 相同）
+# ----------------------------
+def find_transfer_trips_arrive_by(start_stop, end_stop, arrive_by):
+    arrive_by_sec = time_to_seconds(arrive_by)
+    transfer_results = []
+
+    for key, transfer_wait in transfers.items():
+        parts = key.split(" to ")
+        if len(parts) != 2:
+            continue
+        transfer_from = parts[0]  # 第一段的终点（换乘下车站）
+        transfer_to = parts[1]  # 第二段的起点（换乘上车站）
+
+        # 第二段：从 transfer_to 到终点，按时到达
+        trip2_segments = find_segments_with_max(transfer_to, end_stop, arrive_by_sec)
+        if not trip2_segments:
+            continue
+        # 第二段出发越晚，第一段可选的车次越多，只需保留出发最晚的第二段
+        seg2 = max(trip2_segments, key=lambda x: x['departure_sec'])
+        latest_arr_trip1 = seg2['departure_sec'] - transfer_wait
+
+        # 第一段：从起点到 transfer_from，到达时间不晚于第二段出发前的换乘时刻
+        trip1_segments = find_segments_with_max(start_stop, transfer_from, latest_arr_trip1)
+        if not trip1_segments:
+            continue
+        seg1 = max(trip1_segments, key=lambda x: x['departure_sec'])
+        transfer_results.append({
+            'trip1_id': seg1['trip_id'],
+            'trip2_id': seg2['trip_id'],
+            'board_stop': start_stop,
+            'transfer_from': transfer_from,
+            'transfer_to': transfer_to,
+            'alight_stop': end_stop,
+            'departure_time_trip1': seg1['departure_time'],
+            'arrival_time_trip1': seg1['arrival_time'],
+            'stop_count_trip1': seg1['stop_count'],
+            'transfer_wait': transfer_wait,
+            'departure_time_trip2': seg2['departure_time'],
+            'arrival_time_trip2': seg2['arrival_time'],
+            'stop_count_trip2': seg2['stop_count'],
+            'trip1_departure_sec': seg1['departure_sec']
+        })
+    if transfer_results:
+        best_transfer = max(transfer_results, key=lambda x: x['trip1_departure_sec'])
+        return best_transfer
+    return None
+
+
 # ----------------------------
 # 示例调用
 # ----------------------------
@@ -179,3 +277,29 @@ if best_transfer:
     print("-" * 40)
 else:
     print("未找到符合条件的换乘线路。")
+
+print("\n【按时到达的直达线路】")
+arrive_by = "09:00:00"
+latest_direct = find_direct_trip_arrive_by(start_stop, end_stop, arrive_by)
+if latest_direct:
+    print(f"直达线路: {latest_direct['trip_id']}")
+    print(f"  从 {latest_direct['board_stop']} 于 {latest_direct['departure_time']} 上车")
+    print(f"  到 {latest_direct['alight_stop']} 于 {latest_direct['arrival_time']} 下车（{arrive_by} 前到达）")
+    print(f"  经过 {latest_direct['stop_count']} 站")
+    print("-" * 40)
+else:
+    print("未找到符合条件的直达线路。")
+
+print("\n【按时到达的换乘线路】")
+latest_transfer = find_transfer_trips_arrive_by(start_stop, end_stop, arrive_by)
+if latest_transfer:
+    print(f"第一段线路: {latest_transfer['trip1_id']}")
+    print(f"  从 {latest_transfer['board_stop']} 于 {latest_transfer['departure_time_trip1']} 上车")
+    print(f"  到 {latest_transfer['transfer_from']} 于 {latest_transfer['arrival_time_trip1']} 下车")
+    print(f"换乘等待: {latest_transfer['transfer_wait']} 秒后，在 {latest_transfer['transfer_to']} 换乘")
+    print(f"第二段线路: {latest_transfer['trip2_id']}")
+    print(f"  从 {latest_transfer['transfer_to']} 于 {latest_transfer['departure_time_trip2']} 上车")
+    print(f"  到 {latest_transfer['alight_stop']} 于 {latest_transfer['arrival_time_trip2']} 下车")
+    print("-" * 40)
+else:
+    print("未找到符合条件的换乘线路。")
@@ -0,0 +1,393 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, seconds_to_time
+
+# 不可达时间
+INF = np.iinfo(np.int32).max
+
+# 换乘邻接表: from 站点索引 -> [(to 站点索引, 换乘时间秒), ...]，见 compile_timetable.load_transfers
+Transfers = Dict[int, List[Tuple[int, int]]]
+
+
+def make_leg(tt: Timetable, pattern: int, row: int, board_pos: int, alight_pos: int) -> dict:
+    """构造一段乘车记录，字段与 preprocess.find_segments_with_min 的结果一致"""
+    arr, dep = tt.pattern_times(pattern)
+    stops = tt.pattern_stops_of(pattern)
+    dep_sec = int(dep[row, board_pos])
+    arr_sec = int(arr[row, alight_pos])
+    return {
+        'trip_id': tt.trip_ids[tt.pattern_trip_offsets[pattern] + row],
+        'board_stop': tt.stop_ids[stops[board_pos]],
+        'alight_stop': tt.stop_ids[stops[alight_pos]],
+        'departure_time': seconds_to_time(dep_sec),
+        'arrival_time': seconds_to_time(arr_sec),
+        'departure_sec': dep_sec,
+        'arrival_sec': arr_sec,
+        'stop_count': alight_pos - board_pos + 1,
+        'start_index': board_pos,
+        'end_index': alight_pos
+    }
+
+
+def make_journey(legs: List[dict], transfer_waits: List[int]) -> dict:
+    """将若干段乘车记录组合为完整行程，transfer_waits[i] 为第 i 段与第 i+1 段之间的换乘时间"""
+    return {
+        'board_stop': legs[0]['board_stop'],
+        'alight_stop': legs[-1]['alight_stop'],
+        'departure_time': legs[0]['departure_time'],
+        'arrival_time': legs[-1]['arrival_time'],
+        'departure_sec': legs[0]['departure_sec'],
+        'arrival_sec': legs[-1]['arrival_sec'],
+        'transfers': len(legs) - 1,
+        'transfer_waits': transfer_waits,
+        'legs': legs
+    }
+
+
+def to_transfer_result(journey: dict) -> Optional[dict]:
+    """将一次换乘的行程转换为 preprocess.find_transfer_trips 的结果结构，其它换乘次数返回 None"""
+    if journey is None or journey['transfers'] != 1:
+        return None
+    seg1, seg2 = journey['legs']
+    return {
+        'trip1_id': seg1['trip_id'],
+        'trip2_id': seg2['trip_id'],
+        'board_stop': seg1['board_stop'],
+        'transfer_from': seg1['alight_stop'],
+        'transfer_to': seg2['board_stop'],
+        'alight_stop': seg2['alight_stop'],
+        'departure_time_trip1': seg1['departure_time'],
+        'arrival_time_trip1': seg1['arrival_time'],
+        'stop_count_trip1': seg1['stop_count'],
+        'transfer_wait': journey['transfer_waits'][0],
+        'departure_time_trip2': seg2['departure_time'],
+        'arrival_time_trip2': seg2['arrival_time'],
+        'stop_count_trip2': seg2['stop_count'],
+        'trip1_departure_sec': seg1['departure_sec']
+    }
+
+
+def earliest_direct_leg(tt: Timetable, start: int, end: int, min_dep_sec: int) -> Optional[dict]:
+    """
+    查找从 start 到 end（站点索引）、出发时间不早于 min_dep_sec 的直达车段中到达最早的一段。
+
+    每个 pattern 内按出发时间有序且不超车，因此只需二分查找第一趟可乘的车。
+    """
+    best = None
+    best_arr = INF
+    patterns, positions = tt.patterns_at_stop(start)
+    for pattern, idx in zip(patterns.tolist(), positions.tolist()):
+        stops = tt.pattern_stops_of(pattern)
+        later = np.flatnonzero(stops[idx + 1:] == end)
+        if len(later) == 0:
+            continue
+        j = idx + 1 + int(later[0])
+        arr, dep = tt.pattern_times(pattern)
+        row = int(np.searchsorted(dep[:, idx], min_dep_sec, side='left'))
+        if row < len(dep) and arr[row, j] < best_arr:
+            best_arr = int(arr[row, j])
+            best = (pattern, row, idx, j)
+    if best is None:
+        return None
+    return make_leg(tt, *best)
+
+
+class RaptorSearch:
+    """
+    基于轮次的最早到达搜索（RAPTOR）。
+
+    第 k 轮扫描上一轮被改进站点所在的 pattern，得到恰好乘坐 k 趟车的最早到达时间，
+    然后按 transfers.json 中的换乘关系得到下一轮可上车的时间。与 find_transfer_trips 一致，
+    换车只能通过换乘表中的记录（包括同站换乘记录）进行。
+
+    标签在多次 run() 之间保留：按出发时间从晚到早依次调用 run() 即为 rRAPTOR 的 profile 搜索。
+    """
+
+    def __init__(self, tt: Timetable, transfers: Transfers, max_rounds: int = 5):
+        self.tt = tt
+        self.transfers = transfers
+        self.max_rounds = max_rounds
+        self.reset()
+
+    def reset(self) -> None:
+        n = self.tt.n_stops
+        k = self.max_rounds + 1
+        # arrival[k, s]: 最多乘坐 k 趟车到达 s 的最早时间（乘车到达）
+        self.arrival = np.full((k, n), INF, dtype=np.int64)
+        # ready[k, s]: 乘坐 k 趟车后可在 s 上车的最早时间（已计入换乘时间）
+        self.ready = np.full((k, n), INF, dtype=np.int64)
+        # 回溯信息: arrival_parent[k][s] = (pattern, row, board_pos, alight_pos)
+        self.arrival_parent: List[Dict[int, Tuple[int, int, int, int]]] = [{} for _ in range(k)]
+        # ready_parent[k][s] = (换乘起点站, 换乘时间)
+        self.ready_parent: List[Dict[int, Tuple[int, int]]] = [{} for _ in range(k)]
+        self.origin = -1
+
+    def run(self, origin: int, dep_sec: int, target: Optional[int] = None,
+            lower_bounds: Optional[np.ndarray] = None) -> None:
+        """
+        从 origin 在 dep_sec 出发进行一次搜索。
+
+        参数:
+            origin (int): 起点站点索引
+            dep_sec (int): 出发时间（秒）
+            target (Optional[int]): 终点站点索引，给定时用终点的最早到达时间剪枝
+            lower_bounds (Optional[np.ndarray]): 各站点到终点的行程时间下界，给定时做目标导向剪枝
+        """
+        self.origin = origin
+        self.run_many({origin: dep_sec}, target, lower_bounds)
+
+    def run_many(self, seeds: Dict[int, int], target: Optional[int] = None,
+                 lower_bounds: Optional[np.ndarray] = None) -> None:
+        """
+        同时从多个起点站出发进行一次搜索（各起点的第 0 轮标签为各自的出发时间）。
+
+        参数:
+            seeds (Dict[int, int]): 起点站点索引 -> 在该站可上车的最早时间（秒）
+            target (Optional[int]): 终点站点索引，给定时用终点的最早到达时间剪枝
+            lower_bounds (Optional[np.ndarray]): 各站点到终点的行程时间下界，给定时做目标导向剪枝
+        """
+        tt = self.tt
+        marked = set()
+        for origin, dep_sec in seeds.items():
+            if dep_sec < self.ready[0, origin]:
+                self.ready[0, origin] = dep_sec
+                marked.add(origin)
+
+        for k in range(1, self.max_rounds + 1):
+            if not marked:
+                break
+            arrival_k = self.arrival[k]
+            ready_prev = self.ready[k - 1]
+            np.minimum(arrival_k, self.arrival[k - 1], out=arrival_k)
+            parents = self.arrival_parent[k]
+
+            # 收集需要扫描的 pattern 及最早的扫描位置
+            queue: Dict[int, int] = {}
+            for stop in marked:
+                patterns, positions = tt.patterns_at_stop(stop)
+                for pattern, pos in zip(patterns.tolist(), positions.tolist()):
+                    if pos < queue.get(pattern, INF):
+                        queue[pattern] = pos
+
+            improved = set()
+            for pattern, first_pos in queue.items():
+                stops = tt.pattern_stops_of(pattern).tolist()
+                arr, dep = tt.pattern_times(pattern)
+                row = -1
+                board_pos = -1
+                for i in range(first_pos, len(stops)):
+                    stop = stops[i]
+                    if row >= 0:
+                        a = int(arr[row, i])
+                        bound = arrival_k[target] if target is not None else INF
+                        if lower_bounds is not None and a + lower_bounds[stop] >= bound:
+                            pass
+                        elif a < arrival_k[stop] and a < bound:
+                            arrival_k[stop] = a
+                            parents[stop] = (pattern, row, board_pos, i)
+                            improved.add(stop)
+                    t = ready_prev[stop]
+                    if t < INF and (row < 0 or t <= dep[row, i]):
+                        r = int(np.searchsorted(dep[:, i], t, side='left'))
+                        if r < len(dep) and (row < 0 or r < row):
+                            row = r
+                            board_pos = i
+
+            # 换乘
+            ready_k = self.ready[k]
+            np.minimum(ready_k, ready_prev, out=ready_k)
+            ready_parents = self.ready_parent[k]
+            marked = set()
+            for stop in improved:
+                a = arrival_k[stop]
+                for to_stop, transfer_time in self.transfers.get(stop, ()):
+                    t = a + transfer_time
+                    if t < ready_k[to_stop]:
+                        ready_k[to_stop] = t
+                        ready_parents[to_stop] = (stop, transfer_time)
+                        marked.add(to_stop)
+
+    def journey(self, target: int, rounds: Optional[int] = None) -> Optional[dict]:
+        """回溯最多乘坐 rounds 趟车（默认不限）到达 target 的最早到达行程"""
+        k = self.max_rounds if rounds is None else rounds
+        legs: List[dict] = []
+        waits: List[int] = []
+        stop = target
+        limit = INF
+        while True:
+            # 标签可能沿用自更少的轮次，取达到该时间的最少轮次
+            column = self.arrival[1:k + 1, stop]
+            if len(column) == 0 or column.min() >= INF or column.min() > limit:
+                return None
+            k = 1 + int(np.argmax(column == column.min()))
+            pattern, row, board_pos, alight_pos = self.arrival_parent[k][stop]
+            leg = make_leg(self.tt, pattern, row, board_pos, alight_pos)
+            legs.append(leg)
+            board_stop = int(self.tt.pattern_stops_of(pattern)[board_pos])
+            # 找到能赶上这趟车的最少轮次的上车标签
+            column = self.ready[:k, board_stop]
+            k = int(np.argmax(column <= leg['departure_sec']))
+            if k == 0:
+                break
+            stop, transfer_time = self.ready_parent[k][board_stop]
+            waits.append(transfer_time)
+            limit = leg['departure_sec'] - transfer_time
+        legs.reverse()
+        waits.reverse()
+        return make_journey(legs, waits)
+
+    def pareto_journeys(self, target: int) -> List[dict]:
+        """返回乘车次数与到达时间两个维度上的 Pareto 最优行程（乘车次数从少到多）"""
+        journeys = []
+        best = INF
+        for k in range(1, self.max_rounds + 1):
+            if self.arrival[:k + 1, target].min() < best:
+                best = self.arrival[:k + 1, target].min()
+                journeys.append(self.journey(target, k))
+        return journeys
+
+
+def earliest_arrival(tt: Timetable, transfers: Transfers, start_stop: str, end_stop: str,
+                     current_time_sec: int, max_rounds: int = 5,
+                     lower_bounds: Optional[np.ndarray] = None) -> Optional[dict]:
+    """从 start_stop 在 current_time_sec 出发，到达 end_stop 最早的行程；无法到达时返回 None"""
+    origin = tt.stop_idx.get(start_stop)
+    target = tt.stop_idx.get(end_stop)
+    if origin is None or target is None:
+        return None
+    search = RaptorSearch(tt, transfers, max_rounds)
+    search.run(origin, current_time_sec, target, lower_bounds)
+    return search.journey(target)
+
+
+def reverse_transfers(transfers: Transfers) -> Transfers:
+    """将换乘邻接表反向: to 站点索引 -> [(from 站点索引, 换乘时间秒), ...]"""
+    reverse: Transfers = {}
+    for from_stop, edges in transfers.items():
+        for to_stop, transfer_time in edges:
+            reverse.setdefault(to_stop, []).append((from_stop, transfer_time))
+    return reverse
+
+
+class ReverseRaptorSearch:
+    """
+    按到达时间反向的 RAPTOR，用于“在某时刻之前到达、尽量晚出发”的查询。
+
+    从终点的最晚到达时间出发，第 k 轮在每个 pattern 中从后往前扫描，找出在各站下车时
+    仍能按时到达的最晚一趟车，得到最多乘坐 k 趟车时各站的最晚上车时间，然后沿换乘关系反向传播。
+    pattern 内不超车，因此各站的到达时间列有序，可以直接二分查找。
+    """
+
+    def __init__(self, tt: Timetable, transfers: Transfers, max_rounds: int = 5):
+        self.tt = tt
+        self.reverse = reverse_transfers(transfers)
+        self.max_rounds = max_rounds
+        n = tt.n_stops
+        k = max_rounds + 1
+        # departure[k, s]: 最多乘坐 k 趟车、从 s 上车仍能按时到达终点的最晚出发时间
+        self.departure = np.full((k, n), -INF, dtype=np.int64)
+        # latest[k, s]: 乘车到达 s 的最晚时间（之后换乘 k 趟车仍能按时到达终点）
+        self.latest = np.full((k, n), -INF, dtype=np.int64)
+        # departure_parent[k][s] = (pattern, row, board_pos, alight_pos)
+        self.departure_parent: List[Dict[int, Tuple[int, int, int, int]]] = [{} for _ in range(k)]
+        # latest_parent[k][s] = (换乘终点站, 换乘时间)
+        self.latest_parent: List[Dict[int, Tuple[int, int]]] = [{} for _ in range(k)]
+        self.target = -1
+
+    def run(self, target: int, arrive_by_sec: int, origin: Optional[int] = None) -> None:
+        """以 arrive_by_sec 为到达 target 的最晚时间进行搜索，给定 origin 时用起点的最晚出发时间剪枝"""
+        tt = self.tt
+        self.target = target
+        self.latest[0, target] = arrive_by_sec
+        marked = {target}
+
+        for k in range(1, self.max_rounds + 1):
+            if not marked:
+                break
+            departure_k = self.departure[k]
+            latest_prev = self.latest[k - 1]
+            np.maximum(departure_k, self.departure[k - 1], out=departure_k)
+            parents = self.departure_parent[k]
+
+            # 收集需要扫描的 pattern 及最晚的扫描位置
+            queue: Dict[int, int] = {}
+            for stop in marked:
+                patterns, positions = tt.patterns_at_stop(stop)
+                for pattern, pos in zip(patterns.tolist(), positions.tolist()):
+                    if pos > queue.get(pattern, -1):
+                        queue[pattern] = pos
+
+            improved = set()
+            for pattern, last_pos in queue.items():
+                stops = tt.pattern_stops_of(pattern).tolist()
+                arr, dep = tt.pattern_times(pattern)
+                row = -1
+                alight_pos = -1
+                for i in range(last_pos, -1, -1):
+                    stop = stops[i]
+                    if row >= 0:
+                        d = int(dep[row, i])
+                        bound = departure_k[origin] if origin is not None else -INF
+                        if d > departure_k[stop] and d > bound:
+                            departure_k[stop] = d
+                            parents[stop] = (pattern, row, i, alight_pos)
+                            improved.add(stop)
+                    t = latest_prev[stop]
+                    if t > -INF and (row < 0 or t >= arr[row, i]):
+                        r = int(np.searchsorted(arr[:, i], t, side='right')) - 1
+                        if r >= 0 and r > row:
+                            row = r
+                            alight_pos = i
+
+            # 反向换乘
+            latest_k = self.latest[k]
+            np.maximum(latest_k, latest_prev, out=latest_k)
+            latest_parents = self.latest_parent[k]
+            marked = set()
+            for stop in improved:
+                d = departure_k[stop]
+                for from_stop, transfer_time in self.reverse.get(stop, ()):
+                    t = d - transfer_time
+                    if t > latest_k[from_stop]:
+                        latest_k[from_stop] = t
+                        latest_parents[from_stop] = (stop, transfer_time)
+                        marked.add(from_stop)
+
+    def journey(self, origin: int, rounds: Optional[int] = None) -> Optional[dict]:
+        """回溯最多乘坐 rounds 趟车（默认不限）从 origin 出发的最晚出发行程"""
+        k = self.max_rounds if rounds is None else rounds
+        legs: List[dict] = []
+        waits: List[int] = []
+        stop = origin
+        limit = -INF
+        while True:
+            column = self.departure[1:k + 1, stop]
+            if len(column) == 0 or column.max() <= -INF or column.max() < limit:
+                return None
+            k = 1 + int(np.argmax(column == column.max()))
+            pattern, row, board_pos, alight_pos = self.departure_parent[k][stop]
+            leg = make_leg(self.tt, pattern, row, board_pos, alight_pos)
+            legs.append(leg)
+            alight_stop = int(self.tt.pattern_stops_of(pattern)[alight_pos])
+            column = self.latest[:k, alight_stop]
+            k = int(np.argmax(column >= leg['arrival_sec']))
+            if k == 0:
+                break
+            stop, transfer_time = self.latest_parent[k][alight_stop]
+            waits.append(transfer_time)
+            limit = leg['arrival_sec'] + transfer_time
+        return make_journey(legs, waits)
+
+
+def latest_departure(tt: Timetable, transfers: Transfers, start_stop: str, end_stop: str,
+                     arrive_by_sec: int, max_rounds: int = 5) -> Optional[dict]:
+    """在 arrive_by_sec 之前到达 end_stop 的前提下，从 start_stop 出发最晚的行程；结果结构同 earliest_arrival"""
+    origin = tt.stop_idx.get(start_stop)
+    target = tt.stop_idx.get(end_stop)
+    if origin is None or target is None:
+        return None
+    search = ReverseRaptorSearch(tt, transfers, max_rounds)
+    search.run(target, arrive_by_sec, origin)
+    return search.journey(origin)
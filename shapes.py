@@ -0,0 +1,194 @@
+import csv
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, load_transfers, time_to_seconds
+
+# 坐标以百万分之一度的整数保存
+COORD_SCALE = 1e6
+
+# 持久化到 .npz 的数组名称
+SHAPE_ARRAY_NAMES = ('shape_offsets', 'point_lat', 'point_lon', 'geom_offsets', 'geom_points', 'trip_geom')
+
+
+def read_shapes(file_path: str) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    读取 shapes.txt，按 shape_pt_sequence 排序。
+
+    返回:
+        Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]: shape_id -> (纬度, 经度, shape_dist_traveled)
+    """
+    rows: Dict[str, List[Tuple[int, float, float, float]]] = {}
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            rows.setdefault(row['shape_id'], []).append((
+                int(row['shape_pt_sequence']),
+                float(row['shape_pt_lat']),
+                float(row['shape_pt_lon']),
+                float(row['shape_dist_traveled'] or 'nan'),
+            ))
+    shapes = {}
+    for shape_id, points in rows.items():
+        points.sort(key=lambda x: x[0])
+        data = np.array([p[1:] for p in points], dtype=np.float64)
+        shapes[shape_id] = (data[:, 0], data[:, 1], data[:, 2])
+    return shapes
+
+
+def read_trip_shapes(file_path: str) -> Dict[str, str]:
+    """读取 trips.txt 中 trip_id -> shape_id 的对应关系"""
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        return {row['trip_id']: row['shape_id'] for row in csv.DictReader(f) if row.get('shape_id')}
+
+
+def read_stop_distances(file_path: str) -> Dict[str, np.ndarray]:
+    """读取 stop_times.txt 中各站的 shape_dist_traveled，按 stop_sequence 排序（与 read_stop_times 的站序一致）"""
+    rows: Dict[str, List[Tuple[int, float]]] = {}
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            dist = row.get('shape_dist_traveled') or 'nan'
+            rows.setdefault(row['trip_id'], []).append((int(row['stop_sequence']), float(dist)))
+    return {trip_id: np.array([d for _, d in sorted(records)]) for trip_id, records in rows.items()}
+
+
+class ShapeIndex:
+    """
+    编译后的线路几何。
+
+    - 坐标完全相同的 shape 只保存一份: shape s 的点为 point_lat/point_lon[shape_offsets[s]:shape_offsets[s + 1]]；
+    - 每个 trip 指向一条“站点几何” trip_geom[t]，记录各站在全局坐标数组中的下标
+      （geom_points[geom_offsets[g]:geom_offsets[g + 1]]）；停站序列与 shape 都相同的 trip 共用同一条记录；
+    - 因此一段乘车的折线就是坐标数组的一个切片，不需要在 shape 点中查找。
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        for name in SHAPE_ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in SHAPE_ARRAY_NAMES)
+
+    def save(self, npz_output_path: str) -> None:
+        np.savez(npz_output_path, **{name: getattr(self, name) for name in SHAPE_ARRAY_NAMES})
+
+    @classmethod
+    def load(cls, npz_file_path: str) -> 'ShapeIndex':
+        with np.load(npz_file_path) as data:
+            return cls({name: data[name] for name in SHAPE_ARRAY_NAMES})
+
+    def leg_coordinates(self, trip: int, board_pos: int, alight_pos: int) -> Optional[np.ndarray]:
+        """
+        返回 trip 从 board_pos 站到 alight_pos 站的折线坐标 [[经度, 纬度], ...]；没有几何信息时返回 None。
+        """
+        geom = self.trip_geom[trip]
+        if geom < 0:
+            return None
+        base = self.geom_offsets[geom]
+        lo, hi = self.geom_points[base + board_pos], self.geom_points[base + alight_pos] + 1
+        return np.stack([self.point_lon[lo:hi], self.point_lat[lo:hi]], axis=1) / COORD_SCALE
+
+
+def compile_shapes(tt: Timetable, shapes_file_path: str, trips_file_path: str,
+                   stop_times_file_path: str) -> ShapeIndex:
+    """
+    将 shapes.txt 编译为去重的坐标数组，并按 stop_times.txt 中的 shape_dist_traveled
+    计算每个站点在 shape 上对应的点（取距离最接近的 shape 点）。
+
+    参数:
+        tt (Timetable): 编译后的时刻表（站序与其中的 pattern 一致）
+        shapes_file_path (str): shapes.txt 文件的路径
+        trips_file_path (str): trips.txt 文件的路径
+        stop_times_file_path (str): stop_times.txt 文件的路径
+
+    返回:
+        ShapeIndex: 编译后的线路几何
+    """
+    shapes = read_shapes(shapes_file_path)
+    trip_shapes = read_trip_shapes(trips_file_path)
+    stop_distances = read_stop_distances(stop_times_file_path)
+
+    # 坐标去重
+    shape_ids: Dict[str, int] = {}
+    unique: Dict[bytes, int] = {}
+    lats: List[np.ndarray] = []
+    lons: List[np.ndarray] = []
+    dists: List[np.ndarray] = []
+    for shape_id in sorted(shapes):
+        lat, lon, dist = shapes[shape_id]
+        lat_i = np.round(lat * COORD_SCALE).astype(np.int32)
+        lon_i = np.round(lon * COORD_SCALE).astype(np.int32)
+        key = lat_i.tobytes() + lon_i.tobytes() + dist.tobytes()
+        if key not in unique:
+            unique[key] = len(lats)
+            lats.append(lat_i)
+            lons.append(lon_i)
+            dists.append(dist)
+        shape_ids[shape_id] = unique[key]
+    shape_offsets = np.zeros(len(lats) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in lats], out=shape_offsets[1:])
+
+    # 站点几何去重: (shape, 各站距离) 相同的 trip 共用
+    geoms: Dict[Tuple[int, bytes], int] = {}
+    geom_points: List[np.ndarray] = []
+    trip_geom = np.full(tt.n_trips, -1, dtype=np.int32)
+    for trip, trip_id in enumerate(tt.trip_ids):
+        shape = shape_ids.get(trip_shapes.get(trip_id))
+        stop_dist = stop_distances.get(trip_id)
+        if shape is None or stop_dist is None or np.isnan(stop_dist).any() or np.isnan(dists[shape]).any():
+            continue
+        key = (shape, stop_dist.tobytes())
+        if key not in geoms:
+            shape_dist = dists[shape]
+            if len(shape_dist) > 1:
+                idx = np.clip(np.searchsorted(shape_dist, stop_dist), 1, len(shape_dist) - 1)
+                # 取前后两个 shape 点中距离更接近的一个
+                idx -= (stop_dist - shape_dist[idx - 1]) < (shape_dist[idx] - stop_dist)
+            else:
+                idx = np.zeros(len(stop_dist), dtype=np.int64)
+            geoms[key] = len(geom_points)
+            geom_points.append(shape_offsets[shape] + np.maximum.accumulate(idx))
+        trip_geom[trip] = geoms[key]
+    geom_offsets = np.zeros(len(geom_points) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in geom_points], out=geom_offsets[1:])
+
+    return ShapeIndex({
+        'shape_offsets': shape_offsets,
+        'point_lat': np.concatenate(lats) if lats else np.zeros(0, dtype=np.int32),
+        'point_lon': np.concatenate(lons) if lons else np.zeros(0, dtype=np.int32),
+        'geom_offsets': geom_offsets,
+        'geom_points': np.concatenate(geom_points) if geom_points else np.zeros(0, dtype=np.int64),
+        'trip_geom': trip_geom,
+    })
+
+
+def add_leg_geometry(journey: Optional[dict], tt: Timetable, shapes: ShapeIndex) -> Optional[dict]:
+    """为行程的每一段乘车加上 GeoJSON LineString 几何（'geometry' 字段，没有几何信息时为 None）"""
+    if journey is None:
+        return None
+    for leg in journey['legs']:
+        coordinates = shapes.leg_coordinates(tt.trip_idx[leg['trip_id']], leg['start_index'], leg['end_index'])
+        leg['geometry'] = None if coordinates is None else {
+            "type": "LineString",
+            "coordinates": coordinates.tolist()
+        }
+    return journey
+
+
+# 测试代码
+if __name__ == "__main__":
+    from raptor import earliest_arrival
+
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    shapes = compile_shapes(tt, "raw_file/shapes.txt", "raw_file/trips.txt", "raw_file/stop_times.txt")
+    shapes.save("shapes.npz")
+    print(f"去重后 shape 数量: {len(shapes.shape_offsets) - 1}, 站点几何数量: {len(shapes.geom_offsets) - 1}, "
+          f"数组大小: {shapes.nbytes() / 1024 / 1024:.2f} MB")
+
+    transfers = load_transfers("transfers.json", tt.stop_idx)
+    journey = earliest_arrival(tt, transfers, "de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst",
+                               time_to_seconds("04:30:00"))
+    journey = add_leg_geometry(journey, tt, shapes)
+    if journey:
+        for leg in journey['legs']:
+            print(leg['trip_id'], leg['geometry'])
@@ -0,0 +1,295 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, build_stop_patterns, expand_pattern_times, time_to_seconds
+
+# 每个分片保存的时间数组（trip 编号为分片内的局部编号）
+SHARD_ARRAY_NAMES = (
+    'profile_offsets', 'profile_arr', 'profile_dep',
+    'trip_profile', 'trip_start',
+    'exc_offsets', 'exc_pos', 'exc_arr', 'exc_dep',
+)
+
+INDEX_FILE = 'index.npz'
+
+
+def region_of(stop_id: str, depth: int = 2) -> str:
+    """站点所属区域：stop_id 的前 depth 段，例如 de:09162:40:51:51-Hst -> de:09162"""
+    return ':'.join(stop_id.split(':')[:depth])
+
+
+def _shard_path(directory: str, shard: int) -> str:
+    return os.path.join(directory, f"shard_{shard:05d}.npz")
+
+
+def write_sharded(tt: Timetable, output_dir: str,
+                  shard_key: Optional[Callable[[int], str]] = None) -> int:
+    """
+    将编译后的时刻表按区域拆分为多个分片文件。
+
+    站点、pattern 停站序列等路由索引很小，保存在 index.npz 中常驻内存；
+    体积大的部分（运行时间模板、trip 出发时间、例外记录、trip_id）按 pattern 分到各个分片，
+    查询时只加载实际用到的分片。
+
+    参数:
+        tt (Timetable): 编译后的时刻表
+        output_dir (str): 输出目录
+        shard_key (Optional[Callable[[int], str]]): pattern 编号 -> 分片键，
+            默认取 pattern 首站的区域前缀（de:<AGS>）；也可以按线路等其他方式分片
+
+    返回:
+        int: 分片数量
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if shard_key is None:
+        def shard_key(pattern: int) -> str:
+            return region_of(tt.stop_ids[int(tt.pattern_stops_of(pattern)[0])])
+
+    keys = [shard_key(p) for p in range(tt.n_patterns)]
+    shard_names = sorted(set(keys))
+    shard_of_key = {key: i for i, key in enumerate(shard_names)}
+    pattern_shard = np.array([shard_of_key[key] for key in keys], dtype=np.int32)
+    pattern_local_trip = np.zeros(tt.n_patterns, dtype=np.int64)
+
+    for shard in range(len(shard_names)):
+        trips: List[int] = []
+        for pattern in np.flatnonzero(pattern_shard == shard).tolist():
+            pattern_local_trip[pattern] = len(trips)
+            trips.extend(range(tt.pattern_trip_offsets[pattern], tt.pattern_trip_offsets[pattern + 1]))
+        trips_arr = np.array(trips, dtype=np.int64)
+
+        # 只保留本分片用到的运行时间模板，并重新编号
+        used, trip_profile = np.unique(tt.trip_profile[trips_arr], return_inverse=True)
+        profile_lengths = tt.profile_offsets[used + 1] - tt.profile_offsets[used]
+        profile_cols = np.concatenate([np.arange(tt.profile_offsets[p], tt.profile_offsets[p + 1]) for p in used]) \
+            if len(used) else np.zeros(0, dtype=np.int64)
+
+        exc_counts = tt.exc_offsets[trips_arr + 1] - tt.exc_offsets[trips_arr]
+        exc_cols = np.concatenate([np.arange(tt.exc_offsets[t], tt.exc_offsets[t + 1]) for t in trips]) \
+            if trips else np.zeros(0, dtype=np.int64)
+
+        arrays = {
+            'profile_offsets': np.concatenate([[0], np.cumsum(profile_lengths)]).astype(np.int64),
+            'profile_arr': tt.profile_arr[profile_cols],
+            'profile_dep': tt.profile_dep[profile_cols],
+            'trip_profile': trip_profile.astype(np.int32),
+            'trip_start': tt.trip_start[trips_arr],
+            'exc_offsets': np.concatenate([[0], np.cumsum(exc_counts)]).astype(np.int64),
+            'exc_pos': tt.exc_pos[exc_cols],
+            'exc_arr': tt.exc_arr[exc_cols],
+            'exc_dep': tt.exc_dep[exc_cols],
+        }
+        np.savez(_shard_path(output_dir, shard), trip_ids=np.array([tt.trip_ids[t] for t in trips]), **arrays)
+
+    np.savez(os.path.join(output_dir, INDEX_FILE),
+             stop_ids=np.array(tt.stop_ids),
+             pattern_stop_offsets=tt.pattern_stop_offsets,
+             pattern_stops=tt.pattern_stops,
+             pattern_trip_offsets=tt.pattern_trip_offsets,
+             pattern_shard=pattern_shard,
+             pattern_local_trip=pattern_local_trip,
+             shard_names=np.array(shard_names))
+    return len(shard_names)
+
+
+class _Shard:
+    """已加载的分片：时间数组与该分片内 pattern 的时间矩阵缓存（LRU）"""
+
+    def __init__(self, path: str):
+        with np.load(path) as data:
+            for name in SHARD_ARRAY_NAMES:
+                setattr(self, name, data[name])
+            self.trip_ids = data['trip_ids']
+        self.patterns: 'OrderedDict[int, Tuple[np.ndarray, np.ndarray]]' = OrderedDict()
+        self.base_bytes = sum(getattr(self, name).nbytes for name in SHARD_ARRAY_NAMES) + self.trip_ids.nbytes
+        self.pattern_bytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.base_bytes + self.pattern_bytes
+
+    def drop_pattern(self) -> int:
+        """丢弃最久未使用的时间矩阵，返回释放的字节数"""
+        _, (arr, dep) = self.patterns.popitem(last=False)
+        self.pattern_bytes -= arr.nbytes + dep.nbytes
+        return arr.nbytes + dep.nbytes
+
+
+class _LazyTripIds(Sequence):
+    """按全局 trip 编号访问 trip_id，只加载对应的分片"""
+
+    def __init__(self, tt: 'ShardedTimetable'):
+        self._tt = tt
+
+    def __len__(self) -> int:
+        return self._tt.n_trips
+
+    def __getitem__(self, trip):
+        if isinstance(trip, slice):
+            return [self[t] for t in range(*trip.indices(len(self)))]
+        tt = self._tt
+        pattern = int(np.searchsorted(tt.pattern_trip_offsets, trip, side='right')) - 1
+        shard = tt._shard(int(tt.pattern_shard[pattern]))
+        local = tt.pattern_local_trip[pattern] + trip - tt.pattern_trip_offsets[pattern]
+        return str(shard.trip_ids[local])
+
+
+class ShardedTimetable:
+    """
+    按需加载分片的时刻表，提供与 Timetable 相同的路由接口（RaptorSearch 等可以直接使用）。
+
+    常驻内存的只有站点与 pattern 索引；搜索第一次扫描某个 pattern 时才加载其所在分片。
+    已加载的分片（含其中 pattern 的时间矩阵缓存）按 LRU 淘汰，总占用不超过 max_bytes：
+    每个分片的时间矩阵缓存另有 LRU 上限 max_pattern_bytes（默认 max_bytes 的四分之一），
+    只剩一个分片仍超出上限时丢弃它缓存的时间矩阵。分片缓存可以被多个请求线程共享。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, max_pattern_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_pattern_bytes = max_bytes // 4 if max_pattern_bytes is None else max_pattern_bytes
+        with np.load(os.path.join(directory, INDEX_FILE)) as data:
+            self.stop_ids = data['stop_ids'].tolist()
+            self.pattern_stop_offsets = data['pattern_stop_offsets']
+            self.pattern_stops = data['pattern_stops']
+            self.pattern_trip_offsets = data['pattern_trip_offsets']
+            self.pattern_shard = data['pattern_shard']
+            self.pattern_local_trip = data['pattern_local_trip']
+            self.shard_names = data['shard_names'].tolist()
+        self.stop_idx = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self.stop_pattern_offsets, self.stop_pattern_ids, self.stop_pattern_pos = build_stop_patterns(
+            self.pattern_stop_offsets, self.pattern_stops, self.n_stops)
+        self.trip_ids = _LazyTripIds(self)
+        self._trip_pattern: Optional[np.ndarray] = None
+        self._shards: 'OrderedDict[int, _Shard]' = OrderedDict()
+        self.resident_bytes = 0
+        self.loads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def n_stops(self) -> int:
+        return len(self.stop_ids)
+
+    @property
+    def n_trips(self) -> int:
+        return int(self.pattern_trip_offsets[-1])
+
+    @property
+    def n_patterns(self) -> int:
+        return len(self.pattern_stop_offsets) - 1
+
+    @property
+    def trip_pattern(self) -> np.ndarray:
+        """全局 trip 编号 -> pattern 编号（首次访问时由 pattern_trip_offsets 生成）"""
+        if self._trip_pattern is None:
+            self._trip_pattern = np.repeat(np.arange(self.n_patterns, dtype=np.int32),
+                                           np.diff(self.pattern_trip_offsets))
+        return self._trip_pattern
+
+    def patterns_at_stop(self, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回经过站点的 pattern 编号及该站在各 pattern 中的位置"""
+        lo, hi = self.stop_pattern_offsets[stop], self.stop_pattern_offsets[stop + 1]
+        return self.stop_pattern_ids[lo:hi], self.stop_pattern_pos[lo:hi]
+
+    def pattern_stops_of(self, pattern: int) -> np.ndarray:
+        return self.pattern_stops[self.pattern_stop_offsets[pattern]:self.pattern_stop_offsets[pattern + 1]]
+
+    def pattern_trips(self, pattern: int) -> np.ndarray:
+        return np.arange(self.pattern_trip_offsets[pattern], self.pattern_trip_offsets[pattern + 1])
+
+    def _shard(self, shard: int) -> _Shard:
+        """返回分片（必要时从磁盘加载），并将其标记为最近使用"""
+        with self._lock:
+            return self._load(shard)
+
+    def _load(self, shard: int) -> _Shard:
+        # 调用方需持有 self._lock
+        loaded = self._shards.get(shard)
+        if loaded is not None:
+            self._shards.move_to_end(shard)
+            return loaded
+        loaded = _Shard(_shard_path(self.directory, shard))
+        self._shards[shard] = loaded
+        self.resident_bytes += loaded.nbytes
+        self.loads += 1
+        self._evict(keep=shard)
+        return loaded
+
+    def _evict(self, keep: int, evict_shards: bool = True) -> None:
+        """
+        按 LRU 顺序释放内存直到总占用不超过上限：先丢弃其他分片缓存的时间矩阵（可由分片数组重新展开），
+        再淘汰其他分片（需要重新读盘，缓存新的时间矩阵时不淘汰分片），最后丢弃正在使用的分片的时间矩阵。
+        """
+        for shard_id, shard in self._shards.items():
+            while self.resident_bytes > self.max_bytes and shard_id != keep and shard.patterns:
+                self.resident_bytes -= shard.drop_pattern()
+        for shard_id, shard in list(self._shards.items()):
+            if self.resident_bytes <= self.max_bytes or not evict_shards:
+                break
+            if shard_id != keep:
+                del self._shards[shard_id]
+                self.resident_bytes -= shard.nbytes
+                self.evictions += 1
+        current = self._shards[keep]
+        while self.resident_bytes > self.max_bytes and current.patterns:
+            self.resident_bytes -= current.drop_pattern()
+
+    def pattern_times(self, pattern: int) -> Tuple[np.ndarray, np.ndarray]:
+        """与 Timetable.pattern_times 相同；时间矩阵缓存在所属分片中，随分片一起淘汰"""
+        shard_id = int(self.pattern_shard[pattern])
+        with self._lock:
+            shard = self._load(shard_id)
+            cached = shard.patterns.get(pattern)
+            if cached is not None:
+                shard.patterns.move_to_end(pattern)
+                return cached
+
+        # 展开在锁外进行；分片在此期间被淘汰也不影响，只是结果不再缓存
+        t_lo = int(self.pattern_local_trip[pattern])
+        t_hi = t_lo + int(self.pattern_trip_offsets[pattern + 1] - self.pattern_trip_offsets[pattern])
+        n_stops = self.pattern_stop_offsets[pattern + 1] - self.pattern_stop_offsets[pattern]
+        arr, dep = expand_pattern_times(shard, t_lo, t_hi, n_stops)
+
+        size = arr.nbytes + dep.nbytes
+        with self._lock:
+            if self._shards.get(shard_id) is not shard or pattern in shard.patterns or size > self.max_pattern_bytes:
+                return arr, dep
+            shard.patterns[pattern] = (arr, dep)
+            shard.pattern_bytes += size
+            self.resident_bytes += size
+            while shard.pattern_bytes > self.max_pattern_bytes:
+                self.resident_bytes -= shard.drop_pattern()
+            self._evict(keep=shard_id, evict_shards=False)
+        return arr, dep
+
+    def trip_times(self, trip: int) -> Tuple[np.ndarray, np.ndarray]:
+        """还原单个 trip 各站的绝对到达/出发时间（秒）"""
+        pattern = int(self.trip_pattern[trip])
+        arr, dep = self.pattern_times(pattern)
+        row = trip - self.pattern_trip_offsets[pattern]
+        return arr[row], dep[row]
+
+
+# 测试代码
+if __name__ == "__main__":
+    from compile_timetable import load_transfers
+    from raptor import earliest_arrival
+
+    transfers_file = "transfers.json"
+    shard_dir = "timetable_shards"
+
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    count = write_sharded(tt, shard_dir)
+    print(f"已写入 {count} 个分片到 {shard_dir}")
+
+    sharded = ShardedTimetable(shard_dir, max_bytes=32 * 1024 * 1024)
+    transfers = load_transfers(transfers_file, sharded.stop_idx)
+    print(earliest_arrival(sharded, transfers, "de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst",
+                           time_to_seconds("04:30:00")))
+    print(f"已加载分片: {len(sharded._shards)}, 常驻内存: {sharded.resident_bytes / 1024 / 1024:.2f} MB, "
+          f"加载次数: {sharded.loads}, 淘汰次数: {sharded.evictions}")
@@ -0,0 +1,143 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, seconds_to_time, time_to_seconds
+
+
+class StopTripIndex:
+    """
+    站点 -> 经过该站的 trip 集合的倒排索引，附带该站在 trip 中的位置。
+
+    编译后的时刻表中同一 pattern 的 trip 编号连续，因此每个站点的 trip 位图可以按游程压缩：
+    每个 (pattern, 位置) 对应一段 [run_start, run_start + run_length) 的 trip 区间，
+    两个站点的位图求交只需比较游程起点（同一 pattern 的游程起点相同）。
+    """
+
+    def __init__(self, run_offsets: np.ndarray, run_start: np.ndarray, run_length: np.ndarray,
+                 run_pos: np.ndarray):
+        self.run_offsets = run_offsets
+        self.run_start = run_start
+        self.run_length = run_length
+        self.run_pos = run_pos
+
+    @classmethod
+    def from_timetable(cls, tt: Timetable) -> 'StopTripIndex':
+        """由时刻表的站点 -> pattern 索引生成（游程按 trip 编号排序，同一 pattern 内按位置排序）"""
+        lo = tt.pattern_trip_offsets[tt.stop_pattern_ids]
+        hi = tt.pattern_trip_offsets[tt.stop_pattern_ids + 1]
+        return cls(tt.stop_pattern_offsets, lo.astype(np.int64), (hi - lo).astype(np.int32),
+                   tt.stop_pattern_pos.astype(np.int32))
+
+    def save(self, npz_output_path: str) -> None:
+        np.savez(npz_output_path, run_offsets=self.run_offsets, run_start=self.run_start,
+                 run_length=self.run_length, run_pos=self.run_pos)
+
+    @classmethod
+    def load(cls, npz_file_path: str) -> 'StopTripIndex':
+        with np.load(npz_file_path) as data:
+            return cls(data['run_offsets'], data['run_start'], data['run_length'], data['run_pos'])
+
+    def runs(self, stop: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """返回站点的 (游程起点, 游程长度, 站点位置)"""
+        lo, hi = self.run_offsets[stop], self.run_offsets[stop + 1]
+        return self.run_start[lo:hi], self.run_length[lo:hi], self.run_pos[lo:hi]
+
+    def trips_serving(self, stop: int) -> np.ndarray:
+        """展开站点的 trip 位图，返回经过该站的全部 trip 编号"""
+        starts, lengths, _ = self.runs(stop)
+        if len(starts) == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts, first = np.unique(starts, return_index=True)
+        lengths = lengths[first]
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    def direct_runs(self, start: int, end: int) -> List[Tuple[int, int, int, int]]:
+        """
+        两站位图求交并检查先后顺序。
+
+        返回:
+            List[Tuple[int, int, int, int]]: (游程起点, 游程长度, 上车位置, 下车位置)；
+            同一 trip 多次经过起点时，每个上车位置取其后第一次到达终点的位置
+        """
+        a_start, a_length, a_pos = self.runs(start)
+        b_start, _, b_pos = self.runs(end)
+        common = np.intersect1d(a_start, b_start, assume_unique=False)
+        result = []
+        for run in common.tolist():
+            a_lo, a_hi = np.searchsorted(a_start, run, side='left'), np.searchsorted(a_start, run, side='right')
+            b_lo, b_hi = np.searchsorted(b_start, run, side='left'), np.searchsorted(b_start, run, side='right')
+            alight_positions = b_pos[b_lo:b_hi]
+            for board in a_pos[a_lo:a_hi].tolist():
+                k = int(np.searchsorted(alight_positions, board, side='right'))
+                if k < len(alight_positions):
+                    result.append((run, int(a_length[a_lo]), board, int(alight_positions[k])))
+        return result
+
+
+def find_segments_with_min(tt: Timetable, index: StopTripIndex, start_stop: str, end_stop: str,
+                           min_dep_sec: int, first_only: bool = False) -> List[dict]:
+    """
+    与 preprocess.find_segments_with_min 结果结构相同的直达查询：
+    位图求交得到同时经过两站且顺序正确的 trip 区间，再在区间内二分查找满足出发时间的车次。
+
+    参数:
+        first_only (bool): 每个 trip 区间只返回第一趟满足条件的车（区间内不超车，第一趟即最早）
+    """
+    segments = []
+    start = tt.stop_idx.get(start_stop)
+    end = tt.stop_idx.get(end_stop)
+    if start is None or end is None:
+        return segments
+
+    for run, _, i, j in index.direct_runs(start, end):
+        pattern = int(tt.trip_pattern[run])
+        arr, dep = tt.pattern_times(pattern)
+        first = int(np.searchsorted(dep[:, i], min_dep_sec, side='left'))
+        last = min(first + 1, len(dep)) if first_only else len(dep)
+        for row in range(first, last):
+            dep_sec = int(dep[row, i])
+            arr_sec = int(arr[row, j])
+            segments.append({
+                'trip_id': tt.trip_ids[run + row],
+                'board_stop': start_stop,
+                'alight_stop': end_stop,
+                'departure_time': seconds_to_time(dep_sec),
+                'arrival_time': seconds_to_time(arr_sec),
+                'departure_sec': dep_sec,
+                'arrival_sec': arr_sec,
+                'stop_count': j - i + 1,
+                'start_index': i,
+                'end_index': j
+            })
+    return segments
+
+
+def find_direct_trip(tt: Timetable, index: StopTripIndex, start_stop: str, end_stop: str,
+                     current_time: str) -> Optional[dict]:
+    """返回距离当前时间最近的直达车段（与 preprocess.find_direct_trip 相同），没有时返回 None"""
+    segments = find_segments_with_min(tt, index, start_stop, end_stop, time_to_seconds(current_time),
+                                      first_only=True)
+    if segments:
+        return min(segments, key=lambda x: x['departure_sec'])
+    return None
+
+
+# 测试代码
+if __name__ == "__main__":
+    import time
+
+    tt = Timetable.load("timetable.npz", "timetable.json")
+    index = StopTripIndex.from_timetable(tt)
+    index.save("stop_trip_index.npz")
+
+    start_stop = "de:09162:40:51:51-Hst"
+    end_stop = "de:09162:1140:51:51-Hst"
+    print(find_direct_trip(tt, index, start_stop, end_stop, "04:30:00"))
+
+    repeat = 10000
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        find_direct_trip(tt, index, start_stop, end_stop, "04:30:00")
+    print(f"平均查询时间: {(time.perf_counter() - begin) / repeat * 1e6:.1f} 微秒")
@@ -1,14 +1,9 @@
 import csv
 import json
-from neo4j import GraphDatabase
+import neo4j_client
+from neo4j_client import NEO4J_CONFIG, close_drivers, get_driver
 
-# Neo4j连接配置（请根据您的Neo4j实例修改）
-NEO4J_URI = "neo4j://localhost:7687"
-NEO4J_USER = "neo4j"
-NEO4J_PASSWORD = "password"  # 请替换为您的密码
-
-# 初始化Neo4j驱动
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+# Neo4j连接配置见 neo4j_client.NEO4J_CONFIG（可通过环境变量修改），驱动在首次使用时创建并共享连接池
 
 
 # 将时间字符串转换为秒
@@ -83,7 +78,7 @@ def process_transfers(file_path):
 def import_to_neo4j_with_apoc(stops, trip_relations, transfer_relations):
 # 3. 使用APOC导入数据到Neo4j
     try:
-        with driver.session() as session:
+        with get_driver().session(database=NEO4J_CONFIG["database"]) as session:
             print("正在创建站点节点...")
             session.run(
                 "UNWIND $stops AS stop_id MERGE (s:Stop {stop_id: stop_id})",
@@ -127,55 +122,26 @@ def import_to_neo4j_with_apoc(stops, trip_relations, transfer_relations):
         print(f"导入过程中发生错误: {str(e)}")
         raise
 
-# 4. 查询路径规划
+# 4. 查询路径规划（批量查询请使用 neo4j_client.find_paths_batch）
 def find_path(start_stop, end_stop, start_time_str):
-    start_seconds = time_to_seconds(start_time_str)
-
-    with driver.session() as session:
-        result = session.run(
-            """
-            MATCH path = (start:Stop {stop_id: $start_stop})-[:BUS|TRANSFER*]->(end:Stop {stop_id: $end_stop})
-            WITH path, relationships(path) AS rels
-            UNWIND rels AS rel
-            WITH path, rels, 
-                 COLLECT(CASE WHEN type(rel) = 'BUS' THEN rel.departure_time ELSE null END) AS departures,
-                 COLLECT(CASE WHEN type(rel) = 'BUS' THEN rel.arrival_time ELSE null END) AS arrivals,
-                 COLLECT(CASE WHEN type(rel) = 'BUS' THEN rel.trip_id ELSE null END) AS trip_ids,
-                 COLLECT(CASE WHEN type(rel) = 'TRANSFER' THEN rel.transfer_time ELSE null END) AS transfers
-            WHERE ALL(i IN RANGE(0, SIZE(departures)-1) WHERE 
-                      (departures[i] IS NOT NULL AND departures[i] >= $start_seconds) AND
-                      (i = 0 OR arrivals[i-1] + COALESCE(transfers[i-1], 0) <= departures[i]))
-            RETURN path, trip_ids, departures, arrivals, transfers
-            ORDER BY REDUCE(total_time = 0, r IN rels | 
-                            total_time + CASE WHEN type(r) = 'BUS' THEN r.travel_time 
-                                              WHEN type(r) = 'TRANSFER' THEN r.transfer_time 
-                                              ELSE 0 END) ASC
-            LIMIT 1
-            """,
-            start_stop=start_stop,
-            end_stop=end_stop,
-            start_seconds=start_seconds
-        )
-
-        record = result.single()
-        if record:
-            path = record["path"]
-            trip_ids = record["trip_ids"]
-            departures = record["departures"]
-            arrivals = record["arrivals"]
-            transfers = record["transfers"]
-
-            print("路径规划结果：")
-            nodes = path.nodes
-            for i, node in enumerate(nodes):
-                print(f"站点: {node['stop_id']}")
-                if i < len(departures) and departures[i]:
-                    print(f"  行程: {trip_ids[i]}, 出发时间: {seconds_to_time(departures[i])}, "
-                          f"到达时间: {seconds_to_time(arrivals[i])}")
-                if i < len(transfers) and transfers[i]:
-                    print(f"  换乘时间: {transfers[i]}秒")
-        else:
-            print("未找到路径")
+    record = neo4j_client.find_path(start_stop, end_stop, start_time_str)
+    if record:
+        stops = record["stops"]
+        trip_ids = record["trip_ids"]
+        departures = record["departures"]
+        arrivals = record["arrivals"]
+        transfers = record["transfers"]
+
+        print("路径规划结果：")
+        for i, stop_id in enumerate(stops):
+            print(f"站点: {stop_id}")
+            if i < len(departures) and departures[i]:
+                print(f"  行程: {trip_ids[i]}, 出发时间: {seconds_to_time(departures[i])}, "
+                      f"到达时间: {seconds_to_time(arrivals[i])}")
+            if i < len(transfers) and transfers[i]:
+                print(f"  换乘时间: {transfers[i]}秒")
+    else:
+        print("未找到路径")
 
 
 # 主程序
@@ -202,4 +168,4 @@ if __name__ == "__main__":
     find_path(start_stop, end_stop, start_time)
 
     # 关闭驱动
-    driver.close()
\ No newline at end of file
+    close_drivers()
\ No newline at end of file
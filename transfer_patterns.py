@@ -0,0 +1,260 @@
+import os
+from collections import OrderedDict
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, load_transfers, time_to_seconds
+from raptor import INF, RaptorSearch, Transfers, earliest_direct_leg, make_journey
+
+# 换乘模式: (起点, 下车站1, 上车站2, 下车站2, ..., 终点)，均为站点索引
+TransferPattern = Tuple[int, ...]
+
+
+def origin_departures(tt: Timetable, origin: int, day_start: int, day_end: int) -> List[int]:
+    """起点在 [day_start, day_end] 内所有可上车的出发时间（去重，从晚到早）"""
+    times: Set[int] = set()
+    patterns, positions = tt.patterns_at_stop(origin)
+    for pattern, pos in zip(patterns.tolist(), positions.tolist()):
+        if pos == len(tt.pattern_stops_of(pattern)) - 1:
+            continue
+        _, dep = tt.pattern_times(pattern)
+        column = dep[:, pos]
+        times.update(column[(column >= day_start) & (column <= day_end)].tolist())
+    return sorted(times, reverse=True)
+
+
+def compute_transfer_patterns(tt: Timetable, transfers: Transfers, origin: int,
+                              day_start: int = 0, day_end: int = 30 * 3600,
+                              max_rounds: int = 5) -> Set[TransferPattern]:
+    """
+    对起点做全天的 profile 搜索（rRAPTOR），收集到达各站点的所有最优换乘模式。
+
+    按出发时间从晚到早依次搜索并保留标签，每次搜索中被改进的 (轮次, 站点) 标签对应一条
+    在 (出发时间, 到达时间, 乘车次数) 意义下的最优行程，记录其上下车站序列。
+    """
+    search = RaptorSearch(tt, transfers, max_rounds)
+    patterns: Set[TransferPattern] = set()
+    for dep_sec in origin_departures(tt, origin, day_start, day_end):
+        before = search.arrival.copy()
+        search.run(origin, dep_sec)
+        rounds, stops = np.nonzero(search.arrival < before)
+        for k, stop in zip(rounds.tolist(), stops.tolist()):
+            journey = search.journey(stop, k)
+            if journey is None:
+                continue
+            sequence = []
+            for leg in journey['legs']:
+                sequence.append(tt.stop_idx[leg['board_stop']])
+                sequence.append(tt.stop_idx[leg['alight_stop']])
+            patterns.add(tuple(sequence))
+    return patterns
+
+
+def patterns_to_dag(patterns: Iterable[TransferPattern], n_stops: int) -> Dict[str, np.ndarray]:
+    """
+    将同一起点的换乘模式压缩为前缀共享的 DAG（以起点为根）。
+
+    返回的数组:
+        node_stop: 节点对应的站点索引（节点 0 为起点）
+        node_parent: 父节点编号（根节点为 -1），父子节点之间交替为乘车段与换乘段
+        target_offsets / target_nodes: 终点站 -> 以该站结束的模式末端节点（CSR）
+    """
+    node_stop = []
+    node_parent = []
+    children: Dict[Tuple[int, int], int] = {}
+    ends: Dict[int, Set[int]] = {}
+    for pattern in sorted(patterns):
+        if not node_stop:
+            node_stop.append(pattern[0])
+            node_parent.append(-1)
+        node = 0
+        for stop in pattern[1:]:
+            child = children.get((node, stop))
+            if child is None:
+                child = len(node_stop)
+                children[(node, stop)] = child
+                node_stop.append(stop)
+                node_parent.append(node)
+            node = child
+        ends.setdefault(pattern[-1], set()).add(node)
+
+    counts = np.zeros(n_stops, dtype=np.int64)
+    for stop, nodes in ends.items():
+        counts[stop] = len(nodes)
+    target_offsets = np.zeros(n_stops + 1, dtype=np.int64)
+    np.cumsum(counts, out=target_offsets[1:])
+    target_nodes = np.array([node for stop in sorted(ends) for node in sorted(ends[stop])], dtype=np.int32)
+    return {
+        'node_stop': np.array(node_stop, dtype=np.int32),
+        'node_parent': np.array(node_parent, dtype=np.int32),
+        'target_offsets': target_offsets,
+        'target_nodes': target_nodes,
+    }
+
+
+# ----------------------------
+# 离线预计算（多进程，可断点续算）
+# ----------------------------
+_worker_state: dict = {}
+
+
+def _init_worker(npz_path: str, meta_path: str, transfers_path: str, output_dir: str,
+                 day_start: int, day_end: int, max_rounds: int) -> None:
+    tt = Timetable.load(npz_path, meta_path)
+    _worker_state.update(tt=tt, transfers=load_transfers(transfers_path, tt.stop_idx), output_dir=output_dir,
+                         day_start=day_start, day_end=day_end, max_rounds=max_rounds)
+
+
+def _process_origin(origin: int) -> Tuple[int, int]:
+    state = _worker_state
+    tt = state['tt']
+    patterns = compute_transfer_patterns(tt, state['transfers'], origin,
+                                         state['day_start'], state['day_end'], state['max_rounds'])
+    dag = patterns_to_dag(patterns, tt.n_stops)
+    path = os.path.join(state['output_dir'], f"{origin}.npz")
+    # 先写临时文件再改名，中断时不会留下不完整的结果
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, **dag)
+    os.replace(tmp_path, path)
+    return origin, len(patterns)
+
+
+def build_transfer_patterns(npz_path: str, meta_path: str, transfers_path: str, output_dir: str,
+                            origins: Optional[List[str]] = None, workers: Optional[int] = None,
+                            day_start: int = 0, day_end: int = 30 * 3600, max_rounds: int = 5) -> None:
+    """
+    为给定起点（默认全部站点）预计算换乘模式，每个起点保存为 output_dir/<站点索引>.npz。
+
+    参数:
+        npz_path (str) / meta_path (str): compile_timetable 保存的时刻表
+        transfers_path (str): transfers.json 文件的路径
+        output_dir (str): 输出目录，已存在结果的起点会被跳过（断点续算）
+        origins (Optional[List[str]]): 需要预计算的起点 stop_id 列表
+        workers (Optional[int]): 进程数，默认使用全部 CPU
+        day_start (int) / day_end (int): 参与 profile 搜索的出发时间范围（秒）
+        max_rounds (int): 最多乘坐的趟数
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tt = Timetable.load(npz_path, meta_path)
+    if origins is None:
+        origin_idx = list(range(tt.n_stops))
+    else:
+        origin_idx = [tt.stop_idx[stop_id] for stop_id in origins if stop_id in tt.stop_idx]
+    pending = [o for o in origin_idx if not os.path.exists(os.path.join(output_dir, f"{o}.npz"))]
+    print(f"起点数量: {len(origin_idx)}, 待计算: {len(pending)}")
+
+    init_args = (npz_path, meta_path, transfers_path, output_dir, day_start, day_end, max_rounds)
+    with Pool(processes=workers, initializer=_init_worker, initargs=init_args) as pool:
+        for done, (origin, count) in enumerate(pool.imap_unordered(_process_origin, pending), 1):
+            print(f"[{done}/{len(pending)}] {tt.stop_ids[origin]}: {count} 个换乘模式")
+
+
+# ----------------------------
+# 查询：只沿换乘模式做直达查询
+# ----------------------------
+class TransferPatternRouter:
+    """读取预计算的换乘模式 DAG，查询时只对 DAG 上的边做直达连接查询"""
+
+    def __init__(self, tt: Timetable, transfers: Transfers, pattern_dir: str, max_cached_origins: int = 512):
+        self.tt = tt
+        self.pattern_dir = pattern_dir
+        self.transfer_time = {(a, b): t for a, edges in transfers.items() for b, t in edges}
+        self.max_cached_origins = max_cached_origins
+        self._dags: 'OrderedDict[int, Dict[str, np.ndarray]]' = OrderedDict()
+
+    def _dag(self, origin: int) -> Optional[Dict[str, np.ndarray]]:
+        dag = self._dags.get(origin)
+        if dag is not None:
+            self._dags.move_to_end(origin)
+            return dag
+        path = os.path.join(self.pattern_dir, f"{origin}.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            dag = {name: data[name] for name in data.files}
+        self._dags[origin] = dag
+        if len(self._dags) > self.max_cached_origins:
+            self._dags.popitem(last=False)
+        return dag
+
+    def query(self, start_stop: str, end_stop: str, current_time: str) -> Optional[dict]:
+        """返回从 start_stop 在 current_time 之后出发、最早到达 end_stop 的行程（结构同 raptor.make_journey）"""
+        tt = self.tt
+        origin = tt.stop_idx.get(start_stop)
+        target = tt.stop_idx.get(end_stop)
+        if origin is None or target is None:
+            return None
+        dag = self._dag(origin)
+        if dag is None or len(dag['node_stop']) == 0:
+            return None
+        ends = dag['target_nodes'][dag['target_offsets'][target]:dag['target_offsets'][target + 1]]
+        if len(ends) == 0:
+            return None
+
+        node_stop = dag['node_stop']
+        node_parent = dag['node_parent']
+        # 只计算终点模式经过的节点，按深度顺序（父节点先于子节点）
+        depth: Dict[int, int] = {}
+        for end in ends.tolist():
+            path = []
+            node = end
+            while node >= 0 and node not in depth:
+                path.append(node)
+                node = int(node_parent[node])
+            base = depth[node] if node >= 0 else -1
+            for i, n in enumerate(reversed(path)):
+                depth[n] = base + 1 + i
+
+        # time[node]: 到达该节点的最早时间；leg[node]: 到达该节点的乘车段（换乘节点为 None）
+        time = {0: time_to_seconds(current_time)}
+        leg: Dict[int, Optional[dict]] = {0: None}
+        for node in sorted(depth, key=depth.get):
+            if node == 0:
+                continue
+            parent = int(node_parent[node])
+            if time.get(parent, INF) >= INF:
+                time[node] = INF
+                continue
+            if depth[node] % 2 == 1:
+                # 乘车段: 父节点为上车站
+                found = earliest_direct_leg(tt, int(node_stop[parent]), int(node_stop[node]), time[parent])
+                time[node] = found['arrival_sec'] if found else INF
+                leg[node] = found
+            else:
+                # 换乘段: 父节点为下车站
+                transfer_time = self.transfer_time.get((int(node_stop[parent]), int(node_stop[node])))
+                time[node] = INF if transfer_time is None else time[parent] + transfer_time
+                leg[node] = None
+
+        best = min(ends.tolist(), key=lambda n: time.get(n, INF))
+        if time.get(best, INF) >= INF:
+            return None
+        legs = []
+        waits = []
+        node = best
+        while node > 0:
+            if leg.get(node) is not None:
+                legs.append(leg[node])
+            else:
+                waits.append(time[node] - time[int(node_parent[node])])
+            node = int(node_parent[node])
+        legs.reverse()
+        waits.reverse()
+        return make_journey(legs, waits)
+
+
+# 测试代码
+if __name__ == "__main__":
+    npz_file = "timetable.npz"
+    meta_file = "timetable.json"
+    transfers_file = "transfers.json"
+    output_dir = "transfer_patterns"
+
+    build_transfer_patterns(npz_file, meta_file, transfers_file, output_dir,
+                            origins=["de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst"])
+
+    tt = Timetable.load(npz_file, meta_file)
+    router = TransferPatternRouter(tt, load_transfers(transfers_file, tt.stop_idx), output_dir)
+    print(router.query("de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst", "04:30:00"))
@@ -0,0 +1,242 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from compile_timetable import Timetable, load_transfers, time_to_seconds
+from raptor import INF, Transfers, make_journey, make_leg, to_transfer_result
+
+
+def trip_event_offsets(tt: Timetable) -> np.ndarray:
+    """每个 trip 第一个停站事件的全局编号，事件 (t, i) 的编号为 offsets[t] + i"""
+    lengths = np.diff(tt.pattern_stop_offsets)[tt.trip_pattern]
+    offsets = np.zeros(tt.n_trips + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _trip_row(tt: Timetable, trip: int) -> Tuple[int, int]:
+    pattern = int(tt.trip_pattern[trip])
+    return pattern, trip - int(tt.pattern_trip_offsets[pattern])
+
+
+def compute_trip_transfers(tt: Timetable, transfers: Transfers) -> Dict[str, np.ndarray]:
+    """
+    预计算 trip 之间的换乘：对每个下车事件 (trip, 停站序号)，找出换乘后能赶上的每个 pattern 的第一趟车，
+    然后去掉被支配的换乘: 换乘后沿途各站的到达时间（及由此出发的换乘时间）都不比已有方案更早。
+
+    掉头换乘（对方车辆下一站正是本车上一站，且在上一站换乘也来得及）只有在乘客确实乘本车经过上一站时
+    才是多余的；若乘客正是在上一站上车（例如步行经过终点后上车再折返），在上一站并没有乘车到达。
+    因此掉头换乘保留下来并在 transfer_uturn 中标记，查询时只对在上一站之前上车的段跳过，
+    且不参与支配判断，查询结果与 raptor 一致。
+
+    返回:
+        Dict[str, np.ndarray]: event_offsets（trip -> 事件编号起点）以及按事件编号组织的 CSR 数组
+        transfer_offsets / transfer_trip / transfer_pos / transfer_uturn
+    """
+    event_offsets = trip_event_offsets(tt)
+    n_events = int(event_offsets[-1])
+    transfer_time = {(a, b): t for a, edges in transfers.items() for b, t in edges}
+    kept: List[List[Tuple[int, int, bool]]] = [[] for _ in range(n_events)]
+
+    for pattern in range(tt.n_patterns):
+        stops = tt.pattern_stops_of(pattern).tolist()
+        arr, _ = tt.pattern_times(pattern)
+        trip_base = int(tt.pattern_trip_offsets[pattern])
+        for row in range(len(arr)):
+            trip = trip_base + row
+            arr_t = arr[row].tolist()
+            tau_arr: Dict[int, int] = {}
+            tau_ready: Dict[int, int] = {}
+            # 从后往前处理，保证更晚的站点已经计入本车可达的时间
+            for i in range(len(stops) - 1, 0, -1):
+                stop = stops[i]
+                a = arr_t[i]
+                if a < tau_arr.get(stop, INF):
+                    tau_arr[stop] = a
+                for q, d in transfers.get(stop, ()):
+                    if a + d < tau_ready.get(q, INF):
+                        tau_ready[q] = a + d
+
+                for q, d in transfers.get(stop, ()):
+                    ready = a + d
+                    patterns, positions = tt.patterns_at_stop(q)
+                    for other, j in zip(patterns.tolist(), positions.tolist()):
+                        other_stops = tt.pattern_stops_of(other)
+                        if j == len(other_stops) - 1:
+                            continue
+                        other_arr, other_dep = tt.pattern_times(other)
+                        other_row = int(np.searchsorted(other_dep[:, j], ready, side='left'))
+                        if other_row == len(other_dep):
+                            continue
+                        # 同一 pattern 中不早于本车且在后面的站上车，不如留在车上
+                        if other == pattern and other_row >= row and j >= i:
+                            continue
+                        # 掉头换乘: 只对在上一站之前上车的乘客多余，不更新 tau（否则会支配掉上一站的换乘）
+                        prev_stop = stops[i - 1]
+                        uturn = False
+                        if int(other_stops[j + 1]) == prev_stop:
+                            back = transfer_time.get((prev_stop, prev_stop))
+                            uturn = back is not None and arr_t[i - 1] + back <= other_dep[other_row, j + 1]
+
+                        improved = False
+                        for k in range(j + 1, len(other_stops)):
+                            s2 = int(other_stops[k])
+                            a2 = int(other_arr[other_row, k])
+                            if a2 < tau_arr.get(s2, INF):
+                                if not uturn:
+                                    tau_arr[s2] = a2
+                                improved = True
+                            for r, d2 in transfers.get(s2, ()):
+                                if a2 + d2 < tau_ready.get(r, INF):
+                                    if not uturn:
+                                        tau_ready[r] = a2 + d2
+                                    improved = True
+                        if improved:
+                            kept[int(event_offsets[trip]) + i].append(
+                                (int(tt.pattern_trip_offsets[other]) + other_row, j, uturn))
+
+    counts = np.array([len(x) for x in kept], dtype=np.int64)
+    transfer_offsets = np.zeros(n_events + 1, dtype=np.int64)
+    np.cumsum(counts, out=transfer_offsets[1:])
+    return {
+        'event_offsets': event_offsets,
+        'transfer_offsets': transfer_offsets,
+        'transfer_trip': np.array([u for x in kept for u, _, _ in x], dtype=np.int32),
+        'transfer_pos': np.array([j for x in kept for _, j, _ in x], dtype=np.int32),
+        'transfer_uturn': np.array([t for x in kept for _, _, t in x], dtype=bool),
+    }
+
+
+def save_trip_transfers(trip_transfers: Dict[str, np.ndarray], npz_output_path: str) -> None:
+    np.savez(npz_output_path, **trip_transfers)
+
+
+def load_trip_transfers(npz_file_path: str) -> Dict[str, np.ndarray]:
+    with np.load(npz_file_path) as data:
+        return {name: data[name] for name in data.files}
+
+
+class TripBasedRouter:
+    """
+    基于 trip 的最早到达查询：第 n 轮处理乘坐第 n 趟车的 trip 段 (trip, 上车序号, 截止序号)，
+    只沿预计算的换乘边扩展，不再在查询时遍历换乘表。
+    """
+
+    def __init__(self, tt: Timetable, transfers: Transfers, trip_transfers: Dict[str, np.ndarray]):
+        self.tt = tt
+        self.transfer_time = {(a, b): t for a, edges in transfers.items() for b, t in edges}
+        self.event_offsets = trip_transfers['event_offsets']
+        self.transfer_offsets = trip_transfers['transfer_offsets']
+        self.transfer_trip = trip_transfers['transfer_trip']
+        self.transfer_pos = trip_transfers['transfer_pos']
+        self.transfer_uturn = trip_transfers['transfer_uturn']
+
+    def query(self, origin: int, target: int, dep_sec: int, max_rounds: int = 5) -> Optional[dict]:
+        """返回从 origin 在 dep_sec 之后出发、最早到达 target 的行程（结构同 raptor.make_journey）"""
+        tt = self.tt
+        # reached[trip]: 该 trip 已经被到达的最早停站序号
+        reached: Dict[int, int] = {}
+        # 段: (trip, 上车序号, 截止序号, 父段编号, 父段下车序号)
+        segments: List[Tuple[int, int, int, int, int]] = []
+
+        def enqueue(trip: int, pos: int, parent: int, parent_pos: int, queue: List[int]) -> None:
+            end = reached.get(trip, INF)
+            if pos >= end:
+                return
+            pattern, row = _trip_row(tt, trip)
+            n_stops = int(tt.pattern_stop_offsets[pattern + 1] - tt.pattern_stop_offsets[pattern])
+            queue.append(len(segments))
+            segments.append((trip, pos, min(end, n_stops), parent, parent_pos))
+            # 同一 pattern 中更晚的车不需要再从这个位置之后处理
+            last = int(tt.pattern_trip_offsets[pattern + 1])
+            for later in range(trip, last):
+                if reached.get(later, INF) <= pos:
+                    break
+                reached[later] = pos
+
+        queue: List[int] = []
+        patterns, positions = tt.patterns_at_stop(origin)
+        for pattern, pos in zip(patterns.tolist(), positions.tolist()):
+            _, dep = tt.pattern_times(pattern)
+            if pos == dep.shape[1] - 1:
+                continue
+            row = int(np.searchsorted(dep[:, pos], dep_sec, side='left'))
+            if row < len(dep):
+                enqueue(int(tt.pattern_trip_offsets[pattern]) + row, pos, -1, -1, queue)
+
+        best_arr = INF
+        best: Optional[Tuple[int, int]] = None
+        for _ in range(max_rounds):
+            if not queue:
+                break
+            next_queue: List[int] = []
+            for seg in queue:
+                trip, board, end, _, _ = segments[seg]
+                pattern, row = _trip_row(tt, trip)
+                stops = tt.pattern_stops_of(pattern)
+                arr, _ = tt.pattern_times(pattern)
+                base = int(self.event_offsets[trip])
+                for i in range(board + 1, min(end + 1, len(stops))):
+                    a = int(arr[row, i])
+                    if a >= best_arr:
+                        break
+                    if stops[i] == target:
+                        best_arr = a
+                        best = (seg, i)
+                        break
+                    lo, hi = self.transfer_offsets[base + i], self.transfer_offsets[base + i + 1]
+                    # 在上一站之前上车时，掉头换乘可以由上一站的换乘代替
+                    rode_prev = board < i - 1
+                    for u, j, uturn in zip(self.transfer_trip[lo:hi].tolist(), self.transfer_pos[lo:hi].tolist(),
+                                           self.transfer_uturn[lo:hi].tolist()):
+                        if not (uturn and rode_prev):
+                            enqueue(u, j, seg, i, next_queue)
+            queue = next_queue
+
+        if best is None:
+            return None
+        legs = []
+        waits = []
+        seg, alight = best
+        while seg >= 0:
+            trip, board, _, parent, parent_pos = segments[seg]
+            pattern, row = _trip_row(tt, trip)
+            legs.append(make_leg(tt, pattern, row, board, alight))
+            if parent >= 0:
+                parent_pattern, _ = _trip_row(tt, segments[parent][0])
+                from_stop = int(tt.pattern_stops_of(parent_pattern)[parent_pos])
+                to_stop = int(tt.pattern_stops_of(pattern)[board])
+                waits.append(self.transfer_time[(from_stop, to_stop)])
+            seg, alight = parent, parent_pos
+        legs.reverse()
+        waits.reverse()
+        return make_journey(legs, waits)
+
+    def find_journey(self, start_stop: str, end_stop: str, current_time: str, max_rounds: int = 5) -> Optional[dict]:
+        """按 stop_id 和 HH:MM:SS 时间查询，参数形式与 preprocess.find_transfer_trips 相同"""
+        origin = self.tt.stop_idx.get(start_stop)
+        target = self.tt.stop_idx.get(end_stop)
+        if origin is None or target is None:
+            return None
+        return self.query(origin, target, time_to_seconds(current_time), max_rounds)
+
+
+# 测试代码
+if __name__ == "__main__":
+    npz_file = "timetable.npz"
+    meta_file = "timetable.json"
+    transfers_file = "transfers.json"
+    trip_transfers_output = "trip_transfers.npz"
+
+    tt = Timetable.load(npz_file, meta_file)
+    transfers = load_transfers(transfers_file, tt.stop_idx)
+
+    # 预处理
+    trip_transfers = compute_trip_transfers(tt, transfers)
+    print(f"换乘边数量: {len(trip_transfers['transfer_trip'])}")
+    save_trip_transfers(trip_transfers, trip_transfers_output)
+
+    router = TripBasedRouter(tt, transfers, load_trip_transfers(trip_transfers_output))
+    journey = router.find_journey("de:09162:40:51:51-Hst", "de:09162:1140:51:51-Hst", "04:30:00", max_rounds=2)
+    # 一次换乘的行程可以转换为 find_transfer_trips 的结果结构
+    print(to_transfer_result(journey) or journey)
@@ -1,13 +1,185 @@
+import heapq
+import math
+import threading
+from collections import OrderedDict
+
 from flask import Flask, request, jsonify,render_template
 import osmnx as ox
 import networkx as nx
 
+from compile_timetable import Timetable, load_transfers, time_to_seconds
+from isochrone import isochrone_geojson, load_stop_coordinates
+
 app = Flask(__name__)
 
 # 在应用启动时加载保存的慕尼黑步行路网
 G = ox.load_graphml(filepath="munich_walk_network.graphml")
 print("已加载慕尼黑步行路网")
 
+# 节点对路径的 LRU 缓存容量
+PATH_CACHE_SIZE = 20000
+path_cache = OrderedDict()
+# Flask 默认多线程处理请求，缓存的读取、移动与写入需要在同一把锁内完成
+path_cache_lock = threading.Lock()
+
+
+def cache_get(start_node, end_node):
+    with path_cache_lock:
+        path = path_cache.get((start_node, end_node))
+        if path is not None:
+            path_cache.move_to_end((start_node, end_node))
+        return path
+
+
+def cache_put(start_node, end_node, path):
+    with path_cache_lock:
+        path_cache[(start_node, end_node)] = path
+        if len(path_cache) > PATH_CACHE_SIZE:
+            path_cache.popitem(last=False)
+
+
+# 从一个起点出发的 Dijkstra，所有目标节点都确定后立即停止
+def paths_from(source, targets):
+    remaining = set(targets)
+    dist = {source: 0.0}
+    prev = {}
+    heap = [(0.0, source)]
+    settled = set()
+    while heap and remaining:
+        d, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        settled.add(u)
+        remaining.discard(u)
+        for v, edges in G[u].items():
+            # 多重图中两节点之间可能有多条边，取最短的一条
+            nd = d + min(data.get('length', 1.0) for data in edges.values())
+            if nd < dist.get(v, math.inf):
+                dist[v] = nd
+                prev[v] = u
+                heapq.heappush(heap, (nd, v))
+
+    paths = {}
+    for target in targets:
+        if target not in settled:
+            continue
+        path = [target]
+        while path[-1] != source:
+            path.append(prev[path[-1]])
+        path.reverse()
+        paths[target] = path
+    return paths
+
+
+# 批量计算节点对路径：先查缓存，未命中的按起点分组，每个起点只做一次搜索
+def batch_node_paths(node_pairs):
+    results = {}
+    missing = {}
+    for start_node, end_node in node_pairs:
+        path = cache_get(start_node, end_node)
+        if path is not None:
+            results[(start_node, end_node)] = path
+        else:
+            missing.setdefault(start_node, set()).add(end_node)
+
+    for start_node, end_nodes in missing.items():
+        found = paths_from(start_node, end_nodes)
+        for end_node in end_nodes:
+            path = found.get(end_node)
+            if path is not None:
+                cache_put(start_node, end_node, path)
+            results[(start_node, end_node)] = path
+    return results
+
+
+# 提取路径的坐标 [经度, 纬度]
+def path_coordinates(path):
+    return [[G.nodes[node]['x'], G.nodes[node]['y']] for node in path]
+
+
+# 点到线段的近似距离（米），用于 Douglas-Peucker 简化
+def _segment_distance(p, a, b):
+    scale = math.cos(math.radians(a[1])) * 111320.0
+    px, py = (p[0] - a[0]) * scale, (p[1] - a[1]) * 110540.0
+    bx, by = (b[0] - a[0]) * scale, (b[1] - a[1]) * 110540.0
+    length2 = bx * bx + by * by
+    t = 0.0 if length2 == 0 else max(0.0, min(1.0, (px * bx + py * by) / length2))
+    return math.hypot(px - t * bx, py - t * by)
+
+
+# Douglas-Peucker 简化，tolerance 单位为米
+def simplify_coordinates(coordinates, tolerance):
+    if tolerance <= 0 or len(coordinates) < 3:
+        return coordinates
+    keep = [False] * len(coordinates)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coordinates) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_dist, index = 0.0, -1
+        for i in range(first + 1, last):
+            d = _segment_distance(coordinates[i], coordinates[first], coordinates[last])
+            if d > max_dist:
+                max_dist, index = d, i
+        if max_dist > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [c for c, k in zip(coordinates, keep) if k]
+
+
+# Google 编码折线（精度 1e-5，坐标顺序为 纬度, 经度）
+def encode_polyline(coordinates):
+    result = []
+    prev_lat = prev_lon = 0
+    for lon, lat in coordinates:
+        lat_i, lon_i = int(round(lat * 1e5)), int(round(lon * 1e5))
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return ''.join(result)
+
+
+# 按请求的格式输出一条路径
+def format_route(path, output_format='geojson', tolerance=0.0):
+    coordinates = simplify_coordinates(path_coordinates(path), tolerance)
+    if output_format == 'polyline':
+        return {"polyline": encode_polyline(coordinates)}
+    # 构造 GeoJSON
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": coordinates
+        },
+        "properties": {}
+    }
+
+
+# 等时圈所需的时刻表数据，第一次请求时加载
+transit_data = {}
+transit_data_lock = threading.Lock()
+
+
+def get_transit_data():
+    with transit_data_lock:
+        if not transit_data:
+            tt = Timetable.load("timetable.npz", "timetable.json")
+            transfers = load_transfers("transfers.json", tt.stop_idx)
+            coordinates = load_stop_coordinates("stops.txt", tt)
+            transit_data.update(tt=tt, transfers=transfers, coordinates=coordinates)
+    return transit_data
+
+
+# 检查坐标是否为 [纬度, 经度]
+def is_point(value):
+    return (isinstance(value, (list, tuple)) and len(value) == 2
+            and all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in value))
+
 
 # 提供前端页面
 
@@ -30,29 +202,85 @@ def calculate_route():
 
     # 计算最短路径
     try:
-        path = ox.routing.shortest_path(G, start_node, end_node, weight='length')
+        path = batch_node_paths([(start_node, end_node)])[(start_node, end_node)]
         if not path:
             raise nx.NetworkXNoPath("无法找到路径")
 
-        # 提取路径的坐标
-        coordinates = []
-        for node in path:
-            node_data = G.nodes[node]
-            coordinates.append([node_data['x'], node_data['y']])  # [经度, 纬度]
-
-        # 构造 GeoJSON
-        geojson = {
-            "type": "Feature",
-            "geometry": {
-                "type": "LineString",
-                "coordinates": coordinates
-            },
-            "properties": {}
-        }
-        return jsonify(geojson)
+        return jsonify(format_route(path))
     except nx.NetworkXNoPath:
         return jsonify({'error': '无法找到路径'}), 404
 
 
+# 批量计算步行路径的 API 端点
+# 请求: {"pairs": [{"start": [纬度, 经度], "end": [纬度, 经度]}, ...],
+#       "format": "geojson" | "polyline", "simplify": 简化容差（米，可选）}
+@app.route('/calculate_routes', methods=['POST'])
+def calculate_routes():
+    data = request.json
+    pairs = data.get('pairs', [])
+    output_format = data.get('format', 'geojson')
+    if output_format not in ('geojson', 'polyline'):
+        return jsonify({'error': f'不支持的格式: {output_format}'}), 400
+    try:
+        tolerance = float(data.get('simplify', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'simplify 必须是非负数（米）'}), 400
+    if not tolerance >= 0:
+        return jsonify({'error': 'simplify 必须是非负数（米）'}), 400
+    if not isinstance(pairs, list):
+        return jsonify({'error': 'pairs 必须是列表'}), 400
+    if not pairs:
+        return jsonify({'routes': []})
+    for i, pair in enumerate(pairs):
+        if not isinstance(pair, dict) or not is_point(pair.get('start')) or not is_point(pair.get('end')):
+            return jsonify({'error': f'第 {i} 个点对缺少 start / end，或坐标不是 [纬度, 经度]'}), 400
+
+    # 一次性查找所有端点的最近路网节点
+    points = [pair['start'] for pair in pairs] + [pair['end'] for pair in pairs]
+    nodes = ox.distance.nearest_nodes(G, [p[1] for p in points], [p[0] for p in points])
+    node_pairs = list(zip(nodes[:len(pairs)], nodes[len(pairs):]))
+
+    paths = batch_node_paths(node_pairs)
+    routes = []
+    for node_pair in node_pairs:
+        path = paths.get(node_pair)
+        if path:
+            routes.append(format_route(path, output_format, tolerance))
+        else:
+            routes.append({'error': '无法找到路径'})
+    return jsonify({'routes': routes})
+
+
+# 等时圈 API 端点
+# 请求: {"start": [纬度, 经度], "time": "HH:MM:SS", "thresholds": [10, 20, 30]（分钟，可选）,
+#       "cell_size": 栅格边长（米，可选）}
+@app.route('/isochrone', methods=['POST'])
+def isochrone():
+    data = request.json
+    start = data.get('start')  # [纬度, 经度]
+    thresholds = data.get('thresholds', [10, 20, 30])
+    if not is_point(start):
+        return jsonify({'error': 'start 必须是 [纬度, 经度]'}), 400
+    try:
+        dep_sec = time_to_seconds(data.get('time'))
+    except (AttributeError, ValueError):
+        return jsonify({'error': 'time 必须是 HH:MM:SS 格式'}), 400
+    if not isinstance(thresholds, list) or not thresholds:
+        return jsonify({'error': '至少需要一个时间阈值'}), 400
+    if not all(isinstance(t, int) and not isinstance(t, bool) and t > 0 for t in thresholds):
+        return jsonify({'error': '时间阈值必须是正整数（分钟）'}), 400
+    try:
+        cell_size = float(data.get('cell_size', 100))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'cell_size 必须是正数（米）'}), 400
+    if not cell_size > 0:
+        return jsonify({'error': 'cell_size 必须是正数（米）'}), 400
+    transit = get_transit_data()
+    stop_lat, stop_lon = transit['coordinates']
+    result = isochrone_geojson(transit['tt'], transit['transfers'], stop_lat, stop_lon,
+                               start[0], start[1], dep_sec, thresholds, cell_size=cell_size)
+    return jsonify(result)
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)